@@ -0,0 +1,219 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+import scipy.sparse as sp
+
+
+_WORD = re.compile(r'\w+')
+# columns of reports table the features are computed from
+COLUMNS = ('date', 'place', 'text', 'emoticons')
+# names of the dense columns following n-gram and place blocks
+NUMERIC_FEATURES = ('log_length', 'log_emoticons', 'has_emoticons', 'hour_sin', 'hour_cos', 'day_of_year_sin',
+                    'day_of_year_cos') + tuple(f'weekday_{i}' for i in range(7))
+
+
+class TextHandler(object):
+    """Feature extractor turning batches of reports rows into sparse matrices.
+
+        Columns of a matrix are n_features hashed word n-grams of text, max_places + 1 place one-hot columns
+        (the last one counts places beyond max_places) and NUMERIC_FEATURES.
+        Places get columns in order of appearance and keep them across batches, so matrices of all batches
+        have the same layout. N-gram columns are memoized for up to memo_size n-grams."""
+
+    def __init__(self, n_features=2 ** 18, ngram_range=(1, 2), max_places=4096, alternate_sign=True, normalize=True,
+                 memo_size=1000000, cache_dir=None):
+        """Initialize self.
+
+            With alternate_sign set n-gram counts are added with sign taken from the hash, so collisions cancel out
+            instead of accumulating, normalize scales n-gram block of every row to unit length.
+            Setting cache_dir keeps computed feature blocks and the place vocabulary in that directory, see iter_batches().
+
+            Raises ValueError if n_features or max_places isn't positive, if ngram_range is empty."""
+
+        if n_features <= 0 or max_places <= 0 or not 1 <= ngram_range[0] <= ngram_range[1]:
+            raise ValueError
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.max_places = max_places
+        self.alternate_sign = alternate_sign
+        self.normalize = normalize
+        self.memo_size = memo_size
+        self.cache_dir = cache_dir
+        self.places = {}
+        self._memo = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            if os.path.exists(self._places_file()):
+                with open(self._places_file(), encoding='utf-8') as f:
+                    self.places = {place: i for i, place in enumerate(json.load(f))}
+
+    @property
+    def n_columns(self):
+        """Return number of columns of feature matrices."""
+
+        return self.n_features + self.max_places + 1 + len(NUMERIC_FEATURES)
+
+    def _config(self):
+        """Return settings feature values depend on."""
+
+        return [self.n_features, list(self.ngram_range), self.max_places, self.alternate_sign, self.normalize]
+
+    def _places_file(self):
+        """Return cache file of the place vocabulary, every combination of settings has its own vocabulary."""
+
+        digest = hashlib.blake2b(json.dumps(self._config()).encode('utf-8'), digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f'places.{digest}.json')
+
+    def _save_places(self):
+        """Save place vocabulary to the cache directory atomically."""
+
+        with open(self._places_file() + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.places, key=self.places.get), f, ensure_ascii=False)
+        os.replace(self._places_file() + '.tmp', self._places_file())
+
+    def _ngram_column(self, ngram):
+        """Return signed column of n-gram: column + 1 or -(column + 1)."""
+
+        h = zlib.crc32(ngram.encode('utf-8'))
+        column = h % self.n_features + 1
+        if self.alternate_sign and h & 0x80000000:
+            column = -column
+        if len(self._memo) < self.memo_size:
+            self._memo[ngram] = column
+        return column
+
+    def _ngrams(self, texts):
+        """Return CSR matrix of hashed n-gram counts of texts."""
+
+        low, high = self.ngram_range
+        ngrams = []
+        indptr = [0]
+        for text in texts:
+            words = _WORD.findall((text or '').lower())
+            for n in range(low, high + 1):
+                if n == 1:
+                    ngrams.extend(words)
+                else:
+                    ngrams.extend(map(' '.join, zip(*[words[i:] for i in range(n)])))
+            indptr.append(len(ngrams))
+        signed = list(map(self._memo.get, ngrams))
+        if None in signed:
+            for i, column in enumerate(signed):
+                if column is None:
+                    signed[i] = self._ngram_column(ngrams[i])
+        signed = np.array(signed, dtype=np.int64)
+        matrix = sp.csr_matrix((np.sign(signed).astype(np.float64), np.abs(signed) - 1, np.array(indptr)),
+                               shape=(len(indptr) - 1, self.n_features))
+        matrix.sum_duplicates()
+        if self.normalize:
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            matrix = sp.diags(1 / norms) @ matrix
+        return matrix
+
+    def _places(self, places):
+        """Return CSR matrix of place one-hot columns, adding new places to the vocabulary."""
+
+        columns = np.empty(len(places), dtype=np.int64)
+        added = False
+        for i, place in enumerate(places):
+            column = self.places.get(place)
+            if column is None:
+                if len(self.places) < self.max_places:
+                    column = self.places[place] = len(self.places)
+                    added = True
+                else:
+                    column = self.max_places
+            columns[i] = column
+        if added and self.cache_dir is not None:
+            self._save_places()
+        return sp.csr_matrix((np.ones(len(places)), columns, np.arange(len(places) + 1)),
+                             shape=(len(places), self.max_places + 1))
+
+    @staticmethod
+    def _numeric(texts, emoticons, dates):
+        """Return dense array of NUMERIC_FEATURES."""
+
+        lengths = np.fromiter((len(t or '') for t in texts), dtype=np.float64, count=len(texts))
+        emoticons = np.asarray(emoticons, dtype=np.float64)
+        dates = np.asarray(dates, dtype=np.float64)
+        hours = 2 * np.pi * (dates % 86400) / 86400
+        days = 2 * np.pi * (dates / 86400 % 365.25) / 365.25
+        weekdays = np.zeros((len(dates), 7))
+        # 1970-01-01 was Thursday
+        weekdays[np.arange(len(dates)), ((dates // 86400 + 3) % 7).astype(np.int64)] = 1
+        return np.column_stack([np.log1p(lengths), np.log1p(emoticons), emoticons > 0, np.sin(hours), np.cos(hours),
+                                np.sin(days), np.cos(days), weekdays])
+
+    def handle_batch(self, batch):
+        """Return CSR feature matrix of rows given by dictionary mapping COLUMNS to sequences of their values."""
+
+        texts = list(batch['text'])
+        blocks = [self._ngrams(texts), self._places(list(batch['place'])),
+                  sp.csr_matrix(self._numeric(texts, batch['emoticons'], batch['date']))]
+        return sp.hstack(blocks, format='csr')
+
+    def handle(self, features):
+        """Return 1-row CSR feature matrix of a row given by dictionary mapping COLUMNS to values."""
+
+        return self.handle_batch({c: [features[c]] for c in COLUMNS})
+
+    def _block_file(self, db, start, stop, fingerprint):
+        """Return cache file of feature block of rows start:stop of db's table."""
+
+        key = json.dumps([self._config(), fingerprint]).encode('utf-8')
+        digest = hashlib.blake2b(key, digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f'{db.table}.{start}-{stop}.{digest}.npz')
+
+    def _save_block(self, filename, matrix):
+        """Save feature block atomically, removing stale blocks of the same rows."""
+
+        for stale in glob.glob(filename.rsplit('.', 2)[0] + '.*.npz'):
+            os.remove(stale)
+        sp.save_npz(filename + '.tmp.npz', matrix)
+        os.replace(filename + '.tmp.npz', filename)
+
+    def iter_batches(self, db, batch_size=10000):
+        """Yield (start, stop, matrix) feature blocks of rows start:stop of db's current table.
+
+            Rows are streamed from SqlWrapper db by batch_size. With cache_dir set blocks are saved
+            and read back while db.table_stamp() is unchanged: call db.track_version() to detect changes precisely,
+            otherwise any change of the database file invalidates the cache. Any change of the table invalidates all blocks.
+            Commit changes before calling.
+
+            Raises ValueError if db.table or db.pk is None,
+            if the table has no column of COLUMNS."""
+
+        if db.table is None or db.pk is None:
+            raise ValueError
+        positions = [db.column_names.index(c) if c in db.column_names else None for c in COLUMNS]
+        if None in positions:
+            raise ValueError
+        fingerprint = db.table_stamp() if self.cache_dir is not None else None
+        length = len(db)
+        for start in range(0, length, batch_size):
+            stop = min(start + batch_size, length)
+            filename = None
+            if fingerprint is not None:
+                filename = self._block_file(db, start, stop, fingerprint)
+                if os.path.exists(filename):
+                    yield start, stop, sp.load_npz(filename)
+                    continue
+            rows = list(db.iter_rows(slice(start, stop), batch_size))
+            matrix = self.handle_batch({c: [row[i] for row in rows] for c, i in zip(COLUMNS, positions)})
+            if filename is not None:
+                self._save_block(filename, matrix)
+            yield start, stop, matrix
+
+    def transform(self, db, batch_size=10000):
+        """Return CSR feature matrix of all rows of db's current table, see iter_batches()."""
+
+        blocks = [matrix for _, _, matrix in self.iter_batches(db, batch_size)]
+        if not blocks:
+            return sp.csr_matrix((0, self.n_columns))
+        return sp.vstack(blocks, format='csr')
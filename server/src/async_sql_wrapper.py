@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+
+from sql_wrapper import SqlWrapper
+
+
+class AsyncSqlWrapper(object):
+    """Asyncio front-end for SqlWrapper.
+        SqlWrapper is created and used by a single dedicated thread, so coroutines never block the event loop.
+        Every write is committed before its coroutine returns. Appends made while a previous batch is being written
+        are collected and inserted by one extend() in a single transaction."""
+
+    def __init__(self, filename, store_len=True, **kwargs):
+        """Initialize self. Arguments are passed to SqlWrapper."""
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='sql_wrapper')
+        self._db = self._executor.submit(SqlWrapper, filename, store_len, **kwargs).result()
+        self._appends = []
+        self._flush_task = None
+
+    async def _run(self, func, *args, **kwargs):
+        """Run func in the database thread and return its result."""
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _write(self, func, *args, **kwargs):
+        """Run func in the database thread, commit and return its result. Roll back on error."""
+
+        def write():
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+            return result
+
+        return await self._run(write)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self.iter_rows()
+
+    async def close(self):
+        """Write pending appends, commit changes and close database connection."""
+
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._run(self._db.close)
+        self._executor.shutdown()
+
+    async def set_table(self, table_name, pk):
+        """See SqlWrapper.set_table()."""
+
+        await self._run(self._db.set_table, table_name, pk)
+
+    async def len(self):
+        """See SqlWrapper.__len__()."""
+
+        return await self._run(len, self._db)
+
+    async def getitem(self, idx):
+        """See SqlWrapper.__getitem__()."""
+
+        return await self._run(self._db.__getitem__, idx)
+
+    async def index(self, row, start=0, stop=9223372036854775807):
+        """See SqlWrapper.index()."""
+
+        return await self._run(self._db.index, row, start, stop)
+
+    async def count(self, row):
+        """See SqlWrapper.count()."""
+
+        return await self._run(self._db.count, row)
+
+    async def contains(self, row):
+        """Return True if table has row, see SqlWrapper.__contains__()."""
+
+        return await self._run(self._db.__contains__, row)
+
+    async def iter_rows(self, idx=slice(None), chunk_size=1000):
+        """Asynchronously yield rows selected by slice, see SqlWrapper.iter_rows()."""
+
+        rows = await self._run(self._db.iter_rows, idx, chunk_size)
+        try:
+            while True:
+                chunk = await self._run(lambda: list(itertools.islice(rows, chunk_size)))
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield row
+        finally:
+            await self._run(rows.close)
+
+    async def setitem(self, idx, row):
+        """See SqlWrapper.__setitem__()."""
+
+        await self._write(self._db.__setitem__, idx, row)
+
+    async def delitem(self, idx):
+        """See SqlWrapper.__delitem__()."""
+
+        await self._write(self._db.__delitem__, idx)
+
+    async def pop(self, idx=-1):
+        """See SqlWrapper.pop()."""
+
+        return await self._write(self._db.pop, idx)
+
+    async def remove(self, row):
+        """See SqlWrapper.remove()."""
+
+        await self._write(self._db.remove, row)
+
+    async def extend(self, rows, batch_size=10000):
+        """See SqlWrapper.extend(). Rows are iterated in the database thread."""
+
+        return await self._write(self._db.extend, rows, batch_size)
+
+    async def append(self, row):
+        """Insert row, see SqlWrapper.append().
+            Row is queued and written together with other rows appended meanwhile in a single transaction."""
+
+        future = asyncio.get_running_loop().create_future()
+        self._appends.append((row, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_appends())
+        await future
+
+    def _write_appends(self, appends):
+        """Insert queued rows in one transaction and return list of exceptions per row.
+            If the batch fails, rows are inserted one by one to find the wrong ones."""
+
+        try:
+            self._db.extend(row for row, _ in appends)
+            self._db.commit()
+            return [None] * len(appends)
+        except Exception:
+            self._db.rollback()
+        errors = []
+        for row, _ in appends:
+            try:
+                self._db.append(row)
+                self._db.commit()
+                errors.append(None)
+            except Exception as e:
+                self._db.rollback()
+                errors.append(e)
+        return errors
+
+    async def _flush_appends(self):
+        """Write queued rows until the queue is empty."""
+
+        try:
+            while self._appends:
+                appends, self._appends = self._appends, []
+                try:
+                    errors = await self._run(self._write_appends, appends)
+                except Exception as e:
+                    errors = [e] * len(appends)
+                for (_, future), error in zip(appends, errors):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+        finally:
+            self._flush_task = None
@@ -0,0 +1,392 @@
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+
+import json2db
+from sql_wrapper import SqlWrapper
+
+
+SIZES = (10000, 100000, 1000000)
+MODES = {
+    'count': {'store_len': False},
+    'store_len': {'store_len': True},
+    'sparse_ids': {'store_len': True, 'sparse_ids': True},
+}
+PLACES = ('Волга', 'Ока', 'Дон', 'Кама', 'Ладожское озеро', 'Онежское озеро', 'Рыбинское водохранилище', 'Москва-река',
+          'Финский залив', 'Селигер', 'Ахтуба', 'Иртыш')
+WORDS = ('рыба', 'клев', 'поймал', 'щука', 'окунь', 'лещ', 'судак', 'плотва', 'карась', 'берег', 'лодка', 'утром', 'вечером',
+         'ветер', 'вода', 'спиннинг', 'воблер', 'блесна', 'мормышка', 'фидер', 'прикормка', 'червь', 'опарыш', 'глубина',
+         'течение', 'сегодня', 'вчера', 'было', 'очень', 'хорошо', 'плохо', 'ничего', 'штук', 'кг', 'на', 'в', 'и', 'с',
+         'не', 'по', 'у', 'за', 'а', 'но', 'как', 'все', 'еще', 'только', 'там', 'тут')
+MARKUP = ('<br>', '<br />', '<b>', '</b>', '<i>', '</i>', '<a href="http://forum.ru">', '</a>', ':)', ':-)', ':D', ';)',
+          ':(', '=)', ':-P', '<3', ':fish:')
+
+
+def synthetic_entries(count, seed=0):
+    """Yield count raw (date, is_report, main_place, place, text) entries shaped like FORUM.json ones.
+
+        The same seed always gives the same entries."""
+
+    rng = random.Random(seed)
+    start = datetime.datetime(2005, 1, 1).timestamp()
+    for _ in range(count):
+        timestamp = start + rng.random() * 15 * 365 * 86400
+        if rng.random() < 0.3:
+            date = datetime.datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y')
+        else:
+            date = int(timestamp * 1000)
+        place = rng.choice(PLACES)
+        words = rng.choices(WORDS, k=min(int(rng.expovariate(1 / 60)) + 1, 1200))
+        for _ in range(len(words) // 25):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(MARKUP))
+        yield date, rng.random() < 0.4, place if rng.random() < 0.8 else rng.choice(PLACES), place, ' '.join(words)
+
+
+def write_forum_json(filename, count, seed=0):
+    """Write count synthetic entries into column-oriented JSON file like FORUM.json.
+
+        Columns are written one by one, regenerating the entries for each of them."""
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('{"id": {')
+        f.write(', '.join(f'"{i}": {i}' for i in range(count)))
+        f.write('}')
+        for column, name in enumerate(json2db.COLUMNS):
+            f.write(f', "{name}": {{')
+            for i, entry in enumerate(synthetic_entries(count, seed)):
+                f.write(f'{", " if i else ""}"{i}": {json.dumps(entry[column], ensure_ascii=False)}')
+            f.write('}')
+        f.write('}')
+
+
+def make_db(directory, count, seed=0):
+    """Return filename of synthetic 'reports' database with at least count rows, building it if it doesn't exist.
+
+        Rows are cleaned synthetic entries, so the database has the same schema as the one built by json2db.py."""
+
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f'reports_{count}_{seed}.db')
+    if not os.path.exists(filename):
+        rows = json2db.clean_rows(synthetic_entries(count, seed), os.cpu_count())
+        json2db.write_rows(rows, filename, fts_columns=())
+    return filename
+
+
+def measure(func, repeat=5, number=1, setup=None, teardown=None):
+    """Call func number times in each of repeat runs and return dictionary of seconds per call statistics.
+
+        setup and teardown are called before and after every run and are not timed."""
+
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+        if teardown is not None:
+            teardown()
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times),
+            'repeat': repeat, 'number': number}
+
+
+def bench_wrapper(filename, mode, repeat=5, seed=0, selected=lambda name: True):
+    """Return dictionary mapping operation names to timings of SqlWrapper in mode (see MODES) over database filename.
+
+        Changes made by every run are rolled back, so all runs see the same table."""
+
+    db = SqlWrapper(filename, **MODES[mode])
+    db.set_table('reports', 'id')
+    rng = random.Random(seed)
+    length = len(db)
+    positions = {'head': 0, 'middle': length // 2, 'tail': length - 1}
+    row = db[positions['middle']]
+    random_positions = [rng.randrange(length) for _ in range(1000)]
+    new_rows = db[:1000]
+    results = {}
+
+    def run(name, func, number=1, teardown=db.rollback):
+        if selected(name):
+            results[name] = measure(func, repeat, number, teardown=teardown)
+
+    def random_position():
+        random_positions.append(random_positions.pop(0))
+        return random_positions[0]
+
+    try:
+        run('len', lambda: len(db), 100, None)
+        for where, pos in positions.items():
+            run(f'getitem_int_{where}', lambda: db[pos], 100, None)
+        run('getitem_int_random', lambda: db[random_position()], 1000, None)
+        run('getitem_slice_100', lambda: db[length // 2:length // 2 + 100], 10, None)
+        run('getitem_step_slice_100', lambda: db[length // 2:length // 2 + 1000:10], 10, None)
+        run('getitem_projection', lambda: db[['date', 'emoticons']], 1, None)
+        run('append', lambda: db.append(row), 100)
+        run('extend_1000', lambda: db.extend(new_rows), 1)
+        run('setitem_random', lambda: db.__setitem__(random_position(), row), 100)
+        for where, pos in positions.items():
+            target = db[pos]
+            run(f'delitem_{where}', lambda: db.__delitem__(pos))
+            run(f'pop_{where}', lambda: db.pop(pos))
+            run(f'remove_{where}', lambda: db.remove(target))
+            run(f'index_{where}', lambda: db.index(target), 1, None)
+            run(f'count_{where}', lambda: db.count(target), 1, None)
+            run(f'contains_{where}', lambda: target in db, 1, None)
+    finally:
+        db.rollback()
+        db.close()
+    return results
+
+
+def bench_profiles(filename, repeat=5, seed=0, selected=lambda name: True):
+    """Return dictionary mapping '<connection profile>/<operation>' names to timings of SqlWrapper over copies of filename.
+
+        Inserts of 10000 rows including commit and index rebuild compare 'safe' and 'bulk_load' profiles,
+        random reads and text scans compare 'safe' and 'read_heavy' ones."""
+
+    copy = filename + '.copy'
+    state = {}
+    results = {}
+
+    def setup(profile):
+        shutil.copy(filename, copy)
+        state['db'] = SqlWrapper(copy, True)
+        state['db'].set_table('reports', 'id')
+        state['profile'] = state['db'].connection_profile(profile)
+        state['profile'].__enter__()
+
+    def teardown():
+        state['profile'].__exit__(None, None, None)
+        state['db'].close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(copy + suffix):
+                os.remove(copy + suffix)
+
+    def run(name, func, profile, number=1):
+        if selected(f'{profile}/{name}'):
+            results[f'{profile}/{name}'] = measure(func, repeat, number, lambda: setup(profile), teardown)
+
+    with SqlWrapper(filename, True) as db:
+        db.set_table('reports', 'id')
+        length = len(db)
+        rows = db[:min(length, 10000)]
+    rng = random.Random(seed)
+    positions = [rng.randrange(length) for _ in range(1000)]
+
+    def extend():
+        state['db'].extend(rows)
+        state['db'].commit()
+
+    def random_reads():
+        for pos in positions:
+            state['db'][pos]
+
+    for profile in ('safe', 'bulk_load'):
+        run('extend_10000', extend, profile)
+    for profile in ('safe', 'read_heavy'):
+        run('getitem_int_random_1000', random_reads, profile)
+        run('scan_text', lambda: sum(len(text) for (text,) in state['db'].iter_columns(['text'], 10000)), profile)
+    return results
+
+
+def bench_hash_index(filename, repeat=5, seed=0, selected=lambda name: True):
+    """Return dictionary mapping '<layout>/<operation>' names to timings of row lookups and inserts
+        without and with content hash index over copies of filename.
+
+        Fingerprint index is dropped in both layouts, so lookups by full rows can't use it."""
+
+    rng = random.Random(seed)
+    results = {}
+    for layout in ('plain', 'hashed'):
+        copy = f'{filename}.{layout}'
+        shutil.copy(filename, copy)
+        db = SqlWrapper(copy, True)
+        db.set_table('reports', 'id')
+        db.drop_index(name='reports_fingerprint_idx')
+        if layout == 'hashed':
+            db.create_hash_index()
+        db.commit()
+        length = len(db)
+        targets = [db[rng.randrange(length)] for _ in range(10)]
+        rows = db[:min(length, 10000)]
+
+        def run(name, func, teardown=None):
+            if selected(f'{layout}/{name}'):
+                results[f'{layout}/{name}'] = measure(func, repeat, teardown=teardown)
+
+        run('index_random_10', lambda: [db.index(row) for row in targets])
+        run('contains_random_10', lambda: [row in db for row in targets])
+        run('remove_random_10', lambda: [db.remove(row) for row in targets], db.rollback)
+        run('extend_10000', lambda: db.extend(rows), db.rollback)
+        db.close()
+        os.remove(copy)
+    return results
+
+
+def bench_compression(filename, repeat=5, seed=0, selected=lambda name: True):
+    """Return (timings, sizes) comparing plain and compressed text column over copies of filename.
+
+        timings maps '<layout>/<operation>' names to timings of text scans, scans of other columns and random reads,
+        sizes maps layouts to database file sizes in bytes after VACUUM."""
+
+    layouts = {'plain': False, 'zlib': None, 'zlib_dictionary': True}
+    results = {}
+    sizes = {}
+    rng = random.Random(seed)
+    for layout, dictionary in layouts.items():
+        if not any(selected(f'{layout}/{name}') for name in ('scan_text', 'scan_other', 'getitem_int_random_1000')):
+            continue
+        copy = f'{filename}.{layout}'
+        shutil.copy(filename, copy)
+        db = SqlWrapper(copy, True)
+        db.set_table('reports', 'id')
+        if dictionary is not False:
+            db.compress_column('text', dictionary)
+        db.commit()
+        db.curs.execute('VACUUM')
+        sizes[layout] = os.path.getsize(copy)
+        positions = [rng.randrange(len(db)) for _ in range(1000)]
+
+        def run(name, func):
+            if selected(f'{layout}/{name}'):
+                results[f'{layout}/{name}'] = measure(func, repeat)
+
+        run('scan_text', lambda: sum(len(text) for (text,) in db.iter_columns(['text'], 10000)))
+        run('scan_other', lambda: sum(1 for _ in db.iter_columns(['date', 'place', 'emoticons'], 10000)))
+        run('getitem_int_random_1000', lambda: [db[pos] for pos in positions])
+        db.close()
+        os.remove(copy)
+    return results, sizes
+
+
+def bench_ingest(directory, count, processes, repeat=3, seed=0, selected=lambda name: True):
+    """Return dictionary mapping json2db.py stages to timings over synthetic FORUM.json with count entries."""
+
+    os.makedirs(directory, exist_ok=True)
+    source = os.path.join(directory, f'forum_{count}_{seed}.json')
+    if not os.path.exists(source):
+        write_forum_json(source, count, seed)
+    target = os.path.join(directory, 'ingest.db')
+    entries = list(json2db.read_entries(source))
+    rows = list(json2db.clean_rows(entries))
+    results = {}
+
+    def run(name, func, items):
+        if selected(name):
+            results[name] = measure(func, repeat)
+            results[name]['per_second'] = items / results[name]['median']
+
+    run('read', lambda: sum(1 for _ in json2db.read_entries(source)), count)
+    for p in sorted({1, processes}):
+        run(f'clean_{p}_processes', lambda: sum(1 for _ in json2db.clean_rows(entries, p)), count)
+    run('write', lambda: json2db.write_rows(rows, target, fts_columns=()), len(rows))
+    run('write_fts', lambda: json2db.write_rows(rows, target, fts_columns=['text']), len(rows))
+    if os.path.exists(target):
+        os.remove(target)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return list of (name, baseline seconds, seconds, ratio) for operations present in both runs,
+        with ratio of minimal times, and list of names of operations slower than baseline by more than tolerance."""
+
+    rows = []
+    regressions = []
+    for name, stats in results.items():
+        if name in baseline:
+            ratio = stats['min'] / baseline[name]['min'] if baseline[name]['min'] else float('inf')
+            rows.append((name, baseline[name]['min'], stats['min'], ratio))
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SqlWrapper operations and json2db.py ingest on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(SIZES), help='row counts of generated databases')
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=list(MODES), help='SqlWrapper modes to benchmark')
+    parser.add_argument('--ops', nargs='*', default=['*'], help='glob patterns of benchmark names to run, e.g. "*/getitem_*"')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every operation')
+    parser.add_argument('--seed', type=int, default=0, help='seed of generated data')
+    parser.add_argument('--data-dir', default='benchmark_data', help='directory caching generated databases')
+    parser.add_argument('--ingest-size', type=int, default=20000, help='entries of synthetic FORUM.json, 0 to skip ingest')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes for cleaning benchmark')
+    parser.add_argument('--output', help='JSON file to save results to')
+    parser.add_argument('--baseline', help='JSON file with saved results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown against baseline')
+    args = parser.parse_args()
+
+    def selector(prefix):
+        return lambda name: any(fnmatch.fnmatchcase(f'{prefix}/{name}', p) for p in args.ops)
+
+    results = {}
+    sizes = {}
+    for size in args.sizes:
+        filename = make_db(args.data_dir, size, args.seed)
+        for mode in args.modes:
+            prefix = f'{size}/{mode}'
+            for name, stats in bench_wrapper(filename, mode, args.repeat, args.seed, selector(prefix)).items():
+                results[f'{prefix}/{name}'] = stats
+                print(f'{prefix}/{name}: {stats["min"] * 1000:.3f} ms', flush=True)
+        prefix = f'{size}/hash_index'
+        for name, stats in bench_hash_index(filename, args.repeat, args.seed, selector(prefix)).items():
+            results[f'{prefix}/{name}'] = stats
+            print(f'{prefix}/{name}: {stats["min"] * 1000:.3f} ms', flush=True)
+        prefix = f'{size}/compression'
+        timings, layout_sizes = bench_compression(filename, args.repeat, args.seed, selector(prefix))
+        for name, stats in timings.items():
+            results[f'{prefix}/{name}'] = stats
+            print(f'{prefix}/{name}: {stats["min"] * 1000:.3f} ms', flush=True)
+        for layout, file_size in layout_sizes.items():
+            sizes[f'{prefix}/{layout}'] = file_size
+            print(f'{prefix}/{layout}: {file_size / 2 ** 20:.1f} MB', flush=True)
+        prefix = f'{size}/profiles'
+        for name, stats in bench_profiles(filename, args.repeat, args.seed, selector(prefix)).items():
+            results[f'{prefix}/{name}'] = stats
+            print(f'{prefix}/{name}: {stats["min"] * 1000:.3f} ms', flush=True)
+    if args.ingest_size:
+        prefix = f'ingest/{args.ingest_size}'
+        for name, stats in bench_ingest(args.data_dir, args.ingest_size, args.processes, args.repeat, args.seed,
+                                        selector(prefix)).items():
+            results[f'{prefix}/{name}'] = stats
+            print(f'{prefix}/{name}: {stats["per_second"]:.0f} rows/s', flush=True)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'sizes': sizes,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        rows, regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, ratio in rows:
+            mark = ' REGRESSION' if name in regressions else ''
+            print(f'{name}: {old * 1000:.3f} ms -> {new * 1000:.3f} ms ({ratio:.2f}x){mark}')
+        if regressions:
+            sys.exit(f'{len(regressions)} operations are slower than baseline by more than {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+
+from sql_wrapper import _affinity
+
+
+class TextColumn(object):
+    """Text column stored as UTF-8 bytes of all values in data and value boundaries in offsets.
+        Value i is data[offsets[i]:offsets[i + 1]], NULL is stored as empty string."""
+
+    def __init__(self, offsets, data):
+        """Initialize self."""
+
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """Return decoded value by index."""
+
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def byte_lengths(self):
+        """Return array of value lengths in bytes."""
+
+        return np.diff(self.offsets)
+
+    def lengths(self):
+        """Return array of value lengths in characters."""
+
+        starts = (self.data & 0xC0) != 0x80
+        counts = np.concatenate(([0], np.cumsum(starts, dtype=np.int64)))
+        return counts[self.offsets[1:]] - counts[self.offsets[:-1]]
+
+
+def column_kinds(db, columns):
+    """Return dictionary mapping columns to NumPy dtype names or 'text'.
+
+        Columns holding any text or blob are read as text (numbers as their str()), integer columns holding NULL
+        or real values as float64, columns declared BOOLEAN as bool. Kinds of columns without values
+        follow their declared types."""
+
+    declared = {c[0]: c[1] for c in db.columns}
+    kinds = {}
+    for column in columns:
+        if column not in declared:
+            raise ValueError(f'No column {column!r} in table {db.table!r}')
+        types = {t for (t,) in db.curs.execute(f'SELECT DISTINCT typeof("{column}") FROM "{db.table}"')}
+        if not types - {'null'}:
+            # no values to look at, use affinity of the declared type
+            affinity = _affinity(declared[column])
+            if affinity in ('TEXT', 'BLOB'):
+                types.add('text')
+            elif affinity == 'INTEGER' or declared[column] == 'BOOLEAN':
+                types.add('integer')
+            else:
+                types.add('real')
+        if types & {'text', 'blob'}:
+            kinds[column] = 'text'
+        elif types - {'integer'}:
+            kinds[column] = 'float64'
+        elif declared[column] == 'BOOLEAN':
+            kinds[column] = 'bool'
+        else:
+            kinds[column] = 'int64'
+    return kinds
+
+
+def _read_column(db, column, kind, length):
+    """Return NumPy array or TextColumn with values of column ordered by position."""
+
+    values = (v for (v,) in db.iter_columns([column], 10000))
+    if kind != 'text':
+        return np.fromiter((np.nan if v is None else v for v in values) if kind == 'float64' else values, kind, length)
+    offsets = np.zeros(length + 1, np.int64)
+    data = bytearray()
+    for i, v in enumerate(values):
+        if v is not None:
+            data += v if isinstance(v, bytes) else str(v).encode('utf-8')
+        offsets[i + 1] = len(data)
+    return TextColumn(offsets, np.frombuffer(data, np.uint8))
+
+
+def read_columns(db, columns):
+    """Return dictionary mapping columns of db's table to NumPy arrays (TextColumn for text columns).
+
+        Raises ValueError if db.table or db.pk is None,
+        if the table has no such column."""
+
+    length = len(db)
+    return {c: _read_column(db, c, kind, length) for c, kind in column_kinds(db, columns).items()}
+
+
+def _save(filename, array):
+    """Save array to .npy file atomically."""
+
+    with open(filename + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(filename + '.tmp', filename)
+
+
+def load_columns(db, columns, directory=None):
+    """Return dictionary mapping columns of db's table to memory-mapped NumPy arrays (TextColumn for text columns).
+
+        Arrays are cached as .npy files in directory (by default '<database file>.columns') and rebuilt
+        only when db.table_stamp() has changed: call db.track_version() to detect changes precisely,
+        otherwise any change of the database file invalidates the cache. Commit changes before calling.
+
+        Raises ValueError if db.table or db.pk is None,
+        if the table has no such column,
+        if directory is None for in-memory database."""
+
+    if db.table is None or db.pk is None:
+        raise ValueError
+    if directory is None:
+        if db.filename == ':memory:':
+            raise ValueError
+        directory = db.filename + '.columns'
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, db.table)
+    fingerprint = db.table_stamp()
+    meta = {'fingerprint': fingerprint, 'columns': {}}
+    if os.path.exists(prefix + '.json'):
+        with open(prefix + '.json') as f:
+            cached = json.load(f)
+        if cached['fingerprint'] == fingerprint:
+            meta = cached
+    missing = [c for c in columns if c not in meta['columns']]
+    if missing:
+        for column, array in read_columns(db, missing).items():
+            if isinstance(array, TextColumn):
+                _save(f'{prefix}.{column}.offsets.npy', array.offsets)
+                _save(f'{prefix}.{column}.data.npy', array.data)
+                meta['columns'][column] = 'text'
+            else:
+                _save(f'{prefix}.{column}.npy', array)
+                meta['columns'][column] = str(array.dtype)
+        with open(prefix + '.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(prefix + '.json.tmp', prefix + '.json')
+    result = {}
+    for column in columns:
+        if meta['columns'][column] == 'text':
+            result[column] = TextColumn(np.load(f'{prefix}.{column}.offsets.npy', mmap_mode='r'),
+                                        np.load(f'{prefix}.{column}.data.npy', mmap_mode='r'))
+        else:
+            result[column] = np.load(f'{prefix}.{column}.npy', mmap_mode='r')
+    return result
@@ -0,0 +1,249 @@
+import contextlib
+import functools
+import sqlite3
+import threading
+import weakref
+
+from sql_wrapper import SqlWrapper
+
+
+def _writing(method):
+    """Run method holding the writer lock through the writer connection and commit its changes."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            depth = getattr(self._local, 'writing', 0)
+            self._local.writing = depth + 1
+            try:
+                result = method(self, *args, **kwargs)
+                if not depth:
+                    self._writer.commit()
+                return result
+            except BaseException:
+                if not depth:
+                    self._writer.rollback()
+                    self._writer_version = None
+                raise
+            finally:
+                self._local.writing = depth
+    return wrapper
+
+
+def _reading(method):
+    """Run method in a single read transaction of the thread's connection."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, 'writing', 0) or getattr(self._local, 'reading', False):
+            return method(self, *args, **kwargs)
+        conn = self.conn
+        conn.execute('BEGIN')
+        self._local.reading = True
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._local.reading = False
+            conn.commit()
+    return wrapper
+
+
+class _Lease(object):
+    """Thread-local token of a reader connection, the connection is returned to the pool when the token is collected."""
+
+
+def _release(ref, conn):
+    """Return conn to the pool of wrapper ref, called when the thread holding it exits."""
+
+    db = ref()
+    if db is None:
+        conn.close()
+    else:
+        db._check_in(conn)
+
+
+class ConcurrentSqlWrapper(SqlWrapper):
+    """Thread-safe variant of SqlWrapper.
+        Every thread reads through its own connection, so reads run in parallel; database is switched to WAL journal mode
+        so they are not blocked by writes. Writes are serialized through a single writer connection and every write method
+        commits its changes, commit() and rollback() are not needed.
+        Row count is cached per connection and recounted when PRAGMA data_version shows changes made by other connections,
+        so it stays correct with several instances and processes.
+        A thread keeps its reader connection until it exits, then the connection is returned to a pool of up to pool_size
+        idle connections reused by new threads, so short-lived threads don't open connections without limit.
+        Sparse ids and row cache are not supported."""
+
+    def __init__(self, filename, timeout=5.0, pool_size=8):
+        """Initialize self. timeout is how many seconds the writer waits for the database locked by other processes."""
+
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._connections = []
+        self._idle = []
+        self._connections_lock = threading.Lock()
+        self._writer = None
+        self._writer_curs = None
+        self._writer_version = None
+        self._local.writing = 1
+        try:
+            super().__init__(filename, True)
+        finally:
+            self._local.writing = 0
+        self._writer.execute('PRAGMA journal_mode = WAL')
+
+    def _connect(self):
+        """Return new connection to the database usable from any thread."""
+
+        conn = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+        self._register_functions(conn)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _check_out(self):
+        """Return idle connection from the pool or a new one."""
+
+        with self._connections_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _check_in(self, conn):
+        """Return reader connection to the pool or close it if the pool is full."""
+
+        with self._connections_lock:
+            if self.closed or conn not in self._connections:
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+            self._connections.remove(conn)
+        conn.close()
+
+    def _open_connections(self):
+        """Return list of connections of all threads."""
+
+        with self._connections_lock:
+            return list(self._connections)
+
+    @property
+    def conn(self):
+        """Writer connection inside write methods, calling thread's connection otherwise."""
+
+        if getattr(self._local, 'writing', 0):
+            return self._writer
+        if getattr(self._local, 'conn', None) is None:
+            conn = self._check_out()
+            self._local.conn = conn
+            self._local.curs = conn.cursor()
+            self._local.lease = _Lease()
+            weakref.finalize(self._local.lease, _release, weakref.ref(self), conn)
+        return self._local.conn
+
+    @conn.setter
+    def conn(self, conn):
+        self._writer = conn
+
+    @property
+    def curs(self):
+        """Cursor of self.conn."""
+
+        if getattr(self._local, 'writing', 0):
+            return self._writer_curs
+        self.conn
+        return self._local.curs
+
+    @curs.setter
+    def curs(self, curs):
+        self._writer_curs = curs
+
+    def close(self):
+        """Rebuild indexes dropped by 'bulk_load' profile and close connections of all threads."""
+
+        if not self.closed:
+            self._build_deferred_indexes()
+        with self._connections_lock:
+            self.closed = True
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = []
+
+    def __len__(self):
+        """Return table's row count, recounting it only if the table was changed by other connections.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        version = (self.table, self.curs.execute('PRAGMA data_version').fetchone()[0])
+        if getattr(self._local, 'writing', 0):
+            if self._writer_version != version:
+                self._len = self.curs.execute(f'SELECT COUNT("{self.pk}") FROM "{self.table}"').fetchone()[0]
+                self._writer_version = version
+            return self._len
+        if getattr(self._local, 'len_version', None) != version:
+            self._local.len = self.curs.execute(f'SELECT COUNT("{self.pk}") FROM "{self.table}"').fetchone()[0]
+            self._local.len_version = version
+        return self._local.len
+
+    __getitem__ = _reading(SqlWrapper.__getitem__)
+    index = _reading(SqlWrapper.index)
+    count = _reading(SqlWrapper.count)
+    __contains__ = _reading(SqlWrapper.__contains__)
+    table_version = _reading(SqlWrapper.table_version)
+    table_stamp = _reading(SqlWrapper.table_stamp)
+    __setitem__ = _writing(SqlWrapper.__setitem__)
+    __delitem__ = _writing(SqlWrapper.__delitem__)
+    set_table = _writing(SqlWrapper.set_table)
+    append = _writing(SqlWrapper.append)
+    extend = _writing(SqlWrapper.extend)
+    pop = _writing(SqlWrapper.pop)
+    remove = _writing(SqlWrapper.remove)
+    commit = _writing(SqlWrapper.commit)
+    rollback = _writing(SqlWrapper.rollback)
+    track_version = _writing(SqlWrapper.track_version)
+    create_table = _writing(SqlWrapper.create_table)
+    drop_table = _writing(SqlWrapper.drop_table)
+    add_column = _writing(SqlWrapper.add_column)
+    create_index = _writing(SqlWrapper.create_index)
+    drop_index = _writing(SqlWrapper.drop_index)
+    create_fts = _writing(SqlWrapper.create_fts)
+    drop_fts = _writing(SqlWrapper.drop_fts)
+    compress_column = _writing(SqlWrapper.compress_column)
+    decompress_column = _writing(SqlWrapper.decompress_column)
+    create_hash_index = _writing(SqlWrapper.create_hash_index)
+    drop_hash_index = _writing(SqlWrapper.drop_hash_index)
+    set_connection_profile = _writing(SqlWrapper.set_connection_profile)
+    _build_deferred_indexes = _writing(SqlWrapper._build_deferred_indexes)
+
+    @_writing
+    def set_pragmas(self, pragmas):
+        """Apply PRAGMA settings to the writer connection, see SqlWrapper.set_pragmas().
+            locking_mode is skipped: exclusive lock of the writer would lock out readers of all threads."""
+
+        SqlWrapper.set_pragmas(self, {name: value for name, value in pragmas.items() if name != 'locking_mode'})
+
+    @contextlib.contextmanager
+    def connection_profile(self, name):
+        """Return context manager applying the profile to the writer connection inside the block,
+            see SqlWrapper.connection_profile(). The block holds the writer lock, so writes of other threads wait
+            until it ends, and its changes are committed at once at its end.
+            Reads of other threads aren't blocked, locking_mode of the profile is not applied."""
+
+        with self._write_lock:
+            depth = getattr(self._local, 'writing', 0)
+            self._local.writing = depth + 1
+            try:
+                with SqlWrapper.connection_profile(self, name):
+                    yield self
+            except BaseException:
+                if not depth:
+                    self._writer_version = None
+                raise
+            finally:
+                self._local.writing = depth
@@ -0,0 +1,228 @@
+import bisect
+import functools
+import logging
+import re
+import threading
+import time
+
+
+# upper bounds of latency histogram buckets in seconds, the last bucket counts slower calls
+LATENCY_BUCKETS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0)
+# SqlWrapper methods whose calls are counted and timed, nested calls (e.g. __len__ called by __getitem__) included
+METHODS = ('__len__', '__getitem__', '__setitem__', '__delitem__', '__contains__', 'append', 'extend', 'pop', 'remove',
+           'index', 'count', 'set_table', 'commit', 'rollback', 'search', 'create_table', 'drop_table', 'add_column',
+           'create_index', 'drop_index', 'to_numpy', 'load_columns')
+
+logger = logging.getLogger('sql_wrapper')
+
+_INTEGER = re.compile(r'\b\d+\b')
+
+
+class MethodStats(object):
+    """Call count, total time and latency histogram (see LATENCY_BUCKETS) of a method."""
+
+    def __init__(self):
+        """Initialize self."""
+
+        self.calls = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def __repr__(self):
+        return f'MethodStats(calls={self.calls}, seconds={self.seconds:.6f}, histogram={self.histogram})'
+
+
+class StatementStats(object):
+    """Execution count, total time and number of fetched or changed rows of an SQL statement."""
+
+    def __init__(self):
+        """Initialize self."""
+
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+    def __repr__(self):
+        return f'StatementStats(calls={self.calls}, seconds={self.seconds:.6f}, rows={self.rows})'
+
+
+class Profile(object):
+    """Statistics collected by instrumented SqlWrapper, see SqlWrapper.instrument().
+
+        methods maps method names to MethodStats, statements maps SQL text to StatementStats.
+        SqlWrapper puts positions and primary keys into SQL text, so integer literals in it are replaced by '?'.
+        Statements executed longer than slow_query_threshold seconds are logged by 'sql_wrapper' logger
+        and kept in slow as (seconds, sql, params) tuples. trace is called with every statement run by SQLite,
+        including implicit transaction control and with parameters bound."""
+
+    def __init__(self, slow_query_threshold=None, trace=None):
+        """Initialize self."""
+
+        self.slow_query_threshold = slow_query_threshold
+        self.trace = trace
+        self.methods = {}
+        self.statements = {}
+        self.slow = []
+        self._lock = threading.Lock()
+
+    def record_call(self, name, seconds):
+        """Add method call taking seconds."""
+
+        with self._lock:
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = self.methods[name] = MethodStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_statement(self, sql, params, seconds, rows, calls=1):
+        """Add execution of statement taking seconds and return its StatementStats."""
+
+        key = _INTEGER.sub('?', sql)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = StatementStats()
+            stats.calls += calls
+            stats.seconds += seconds
+            stats.rows += max(rows, 0)
+            if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+                self.slow.append((seconds, sql, params))
+                logger.warning('Slow query (%.3f s): %s %r', seconds, sql, params)
+        return stats
+
+    def record_fetch(self, stats, seconds, rows):
+        """Add time and rows of fetching results to stats of a statement."""
+
+        with self._lock:
+            stats.seconds += seconds
+            stats.rows += rows
+
+    def clear(self):
+        """Drop collected statistics."""
+
+        with self._lock:
+            self.methods = {}
+            self.statements = {}
+            self.slow = []
+
+    def report(self, limit=20):
+        """Return text table of methods and limit slowest statements ordered by total time."""
+
+        lines = [f'{"method":<24}{"calls":>10}{"total, s":>12}{"mean, ms":>12}']
+        for name, stats in sorted(self.methods.items(), key=lambda item: -item[1].seconds):
+            lines.append(f'{name:<24}{stats.calls:>10}{stats.seconds:>12.4f}{stats.seconds / stats.calls * 1000:>12.3f}')
+        lines.append('')
+        lines.append(f'{"calls":>10}{"rows":>10}{"total, s":>12}  statement')
+        statements = sorted(self.statements.items(), key=lambda item: -item[1].seconds)[:limit]
+        for sql, stats in statements:
+            lines.append(f'{stats.calls:>10}{stats.rows:>10}{stats.seconds:>12.4f}  {" ".join(sql.split())}')
+        return '\n'.join(lines)
+
+
+class _ProfiledCursor(object):
+    """Cursor proxy recording statements and fetched rows into profile."""
+
+    def __init__(self, cursor, profile):
+        """Initialize self."""
+
+        self._cursor = cursor
+        self._profile = profile
+        self._stats = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        self._cursor.execute(sql, params)
+        self._stats = self._profile.record_statement(sql, params, time.perf_counter() - start, self._cursor.rowcount)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        self._cursor.executemany(sql, seq_of_params)
+        self._stats = self._profile.record_statement(sql, f'<{len(seq_of_params)} rows>', time.perf_counter() - start,
+                                                     self._cursor.rowcount, len(seq_of_params))
+        return self
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        rows = fetch(*args)
+        if self._stats is not None:
+            count = len(rows) if isinstance(rows, list) else int(rows is not None)
+            self._profile.record_fetch(self._stats, time.perf_counter() - start, count)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, self._cursor.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+def _timed(name, method):
+    """Return method recording its calls into self.profile."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profile = self.profile
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profile.record_call(name, time.perf_counter() - start)
+    return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def instrumented_class(cls):
+    """Return subclass of SqlWrapper class cls recording method calls and statements into self.profile.
+
+        Instances are switched to it only while instrumented, so the original class runs without any overhead."""
+
+    curs = getattr(cls, 'curs', None)
+    if isinstance(curs, property):
+        get_curs, set_curs = curs.fget, curs.fset
+    else:
+        def get_curs(self):
+            return self.__dict__['curs']
+
+        def set_curs(self, value):
+            self.__dict__['curs'] = value
+
+    def _cursor(self):
+        return _ProfiledCursor(cls._cursor(self), self.profile)
+
+    def _connect(self):
+        conn = cls._connect(self)
+        conn.set_trace_callback(self.profile.trace)
+        return conn
+
+    namespace = {
+        '__doc__': cls.__doc__,
+        '__module__': cls.__module__,
+        '__qualname__': cls.__qualname__,
+        '_original_class': cls,
+        'curs': property(lambda self: _ProfiledCursor(get_curs(self), self.profile), set_curs),
+        '_cursor': _cursor,
+        '_connect': _connect,
+    }
+    for name in METHODS:
+        if hasattr(cls, name):
+            namespace[name] = _timed(name, getattr(cls, name))
+    return type(cls.__name__, (cls,), namespace)
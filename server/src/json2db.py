@@ -1,50 +1,524 @@
-import json
+import argparse
+import codecs
+import collections
+import concurrent.futures
 import datetime
-import re
+import hashlib
+import itertools
+import json
 import os
+import re
 import sqlite3
 
+import compression
+from sql_wrapper import COMPRESSION_TABLE, CONNECTION_PROFILES, HASH_COLUMN, HIDDEN_PREFIX, SqlWrapper, content_hash
+
+
+COLUMNS = ('date', 'is_report', 'main_place', 'place', 'text')
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DATE = re.compile(r'\d\d.\d\d.\d\d\d\d')
+# html tags or emoticons (group 5)
+_MARKUP = re.compile(r'(<\s*(\/)?\s*[^\s<>"=\/]+(?(2)|(\s+[a-z_-]+(\s*=\s*"[^"]*")?)*)\s*>)|((\s*:\s?[^\Wа-я]+\s?:)|(\:\s?\w+\s?\:|\<[\/\]?3|[\(\)\\Dd|\*\$][\-\^]?[\:\;\=]|[\:\;\=B8][\-\^]?[3DdOoPp\@\$\*\\)\(\/\|])(?=\s|[\!\.\?]|$))')
+_SPACES = re.compile(' {2,}')
+# unclosed tag ending the text
+_TAG_TAIL = re.compile(r'<\s*(?:/\s*)?(?:[^\s<>"=/]+(?:\s+[a-z_-]+(?:\s*=\s*(?:"[^"]*"?)?)?)*\s*)?\Z')
+# reversed tails of text an emoticon may start in
+_COLON_TAIL = re.compile(r'(?::?\s?\w*\s?:)?\s*')
+_SHORT_TAIL = re.compile(r'[:;=]?[-^]?[/\]?3|\[()\\Dd*$]<|<|[3DdOoPp@$*\\)(/|]?[-^]?[:;=B8]')
+# how much pending text clean_text() keeps before looking for its final part
+PENDING_SIZE = 256
+# rests of such matches following the tail
+_TAG_HEADS = (re.compile(r'[\s/]*[^\s<>"=/]*(?:[\sa-z_=-]+|"[^"]*")*>?'),
+              re.compile(r'[^"]*"(?:[\sa-z_=-]+|"[^"]*")*>?'))
+_COLON_HEAD = re.compile(r'\s*:?\s*\w*\s*:?')
+
+# hidden column holding fingerprint() of the entry the row was cleaned from, NULL in rows added through SqlWrapper
+FINGERPRINT_COLUMN = HIDDEN_PREFIX + 'fingerprint'
+# table of fingerprints of entries filtered out by merge_rows(), so they aren't cleaned again
+FILTERED_TABLE = 'filtered_entries'
+INSERT_SQL = f'INSERT INTO reports (date, is_report, main_place, place, text, emoticons, {FINGERPRINT_COLUMN}) VALUES (?, ?, ?, ?, ?, ?, ?)'
+HASHED_INSERT_SQL = f'INSERT INTO reports (date, is_report, main_place, place, text, emoticons, {FINGERPRINT_COLUMN}, {HASH_COLUMN}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+# declared types of the visible columns of cleaned rows, that is all but the fingerprint, see content_hash()
+ROW_TYPES = ('INTEGER', 'BOOLEAN', 'TEXT', 'TEXT', 'TEXT', 'INTEGER')
+
+
+class JsonStream(object):
+    """Incremental reader of a JSON document stored in a binary file.
+        Only the current chunk and the value being decoded are kept in memory."""
+
+    def __init__(self, file, offset=0, chunk_size=1 << 16):
+        """Initialize self and seek file to the byte offset."""
+
+        self.file = file
+        self.file.seek(offset)
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        """Drop consumed part of the buffer and read next chunk of the file."""
+
+        chunk = self.file.read(self.chunk_size)
+        self.eof = not chunk
+        self.offset += len(self.buffer[:self.pos].encode('utf-8'))
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+
+    def tell(self):
+        """Return byte offset of the current position."""
+
+        return self.offset + len(self.buffer[:self.pos].encode('utf-8'))
+
+    def peek(self):
+        """Return next non-whitespace character without consuming it or empty string at the end of file."""
+
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ''
+            self._read()
+
+    def expect(self, char):
+        """Consume next non-whitespace character.
+
+            Raises ValueError if it is not char."""
+
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at byte {self.tell()}')
+        self.pos += 1
+
+    def value(self):
+        """Decode and return next JSON value."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._read()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # a number may continue in the next chunk
+                self._read()
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Yield (key, value) pairs of the JSON object starting at the current position."""
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'Expected \',\' or \'}}\' at byte {self.tell() - 1}')
+
+
+def column_offsets(filename):
+    """Return dictionary of byte offsets of column objects in column-oriented JSON file."""
+
+    offsets = {}
+    with open(filename, 'rb') as f:
+        stream = JsonStream(f)
+        stream.expect('{')
+        while stream.peek() not in ('}', ''):
+            key = stream.value()
+            stream.expect(':')
+            stream.peek()
+            offsets[key] = stream.tell()
+            for _ in stream.items():
+                pass
+            if stream.peek() == ',':
+                stream.pos += 1
+    return offsets
+
+
+def read_entries(filename):
+    """Yield (date, is_report, main_place, place, text) tuples from column-oriented JSON file.
+
+        Every column is read by its own file handle, so memory usage doesn't depend on file size."""
+
+    offsets = column_offsets(filename)
+    files = [open(filename, 'rb') for _ in COLUMNS]
+    try:
+        columns = [JsonStream(f, offsets[c]).items() for f, c in zip(files, COLUMNS)]
+        for values in zip(*columns):
+            yield tuple(v for _, v in values)
+    finally:
+        for f in files:
+            f.close()
+
+
+def _rewind(text, pos):
+    """Return earliest start of a match created by removing text at pos.
+
+        Such a match spans pos, so it starts in an unclosed tag, a ':word:' emoticon or a short emoticon ending at pos.
+        If pos is returned, no match can start before pos whatever follows it."""
+
+    if pos == 0:
+        return 0
+    tail = text[pos - 1::-1]
+    length = _COLON_TAIL.match(tail).end()
+    match = _SHORT_TAIL.match(tail)
+    if match is not None:
+        length = max(length, match.end())
+    start = pos - length
+    if '<' in tail:
+        match = _TAG_TAIL.search(text, 0, pos)
+        if match is not None:
+            start = min(start, match.start())
+    return start
+
+
+def _reach(text, pos, tail):
+    """Return how far after pos a match starting in tail preceding text[pos:] may read, its lookahead included."""
+
+    length = max(3, _COLON_HEAD.match(text, pos).end() - pos)
+    if '<' in tail:
+        patterns = _TAG_HEADS if '"' in tail else _TAG_HEADS[:1]
+        for pattern in patterns:
+            match = pattern.match(text, pos)
+            if match is not None:
+                length = max(length, match.end() - pos)
+    return pos + length + 1
+
+
+def clean_text(text):
+    """Return (text, emoticons) where text is stripped of html tags, emoticons and repeated spaces.
+
+        Matches are removed one by one like the first occurrence of the leftmost match removed by
+        text.replace(match, '', 1), so removals may join text into new matches. The text is cleaned in one forward pass:
+        kept text is collected in a list, and only its tail where such new matches may start is searched again,
+        together with as much of the following text as they can cover. Only emoticons followed by a space,
+        punctuation or the end can have an earlier occurrence which isn't a match, so only they are looked up
+        in the whole kept text."""
+
+    emoticons = 0
+    # cleaned text is ''.join(kept) + pending + text[pos:]
+    kept = []
+    pending = ''
+    limit = PENDING_SIZE
+    pos = 0
+    while True:
+        match = None
+        if pending:
+            start = _rewind(pending, len(pending))
+            if start == len(pending):
+                kept.append(pending)
+                pending = ''
+            elif len(pending) > limit:
+                # from now on text is removed only after start, so the text preceding the last position before start
+                # which no match can cross is final
+                previous, final = len(pending), start
+                while final != previous:
+                    previous, final = final, _rewind(pending, final)
+                kept.append(pending[:final])
+                pending = pending[final:]
+                start -= final
+                limit = len(pending) + PENDING_SIZE
+            if pending:
+                tail = pending[start:]
+                match = _MARKUP.search(tail + text[pos:_reach(text, pos, tail)])
+                if match is not None and match.start() < len(tail):
+                    head = pending[:start + match.start()]
+                    pos += match.end() - len(tail)
+                else:
+                    match = None
+        if match is None:
+            match = _MARKUP.search(text, pos)
+            if match is None:
+                break
+            head = pending + text[pos:match.start()]
+            pos = match.end()
+        if match.group(5):
+            emoticons += 1
+        if match.group(7) is not None:
+            before = ''.join(kept) + head
+            first = (before + match.group(0)).find(match.group(0))
+            if first < len(before):
+                text = before + match.group(0) + text[pos:]
+                text = text[:first] + text[first + len(match.group(0)):]
+                kept = []
+                head = text[:first]
+                pos = first
+        pending = head
+    return _SPACES.sub(' ', ''.join(kept) + pending + text[pos:]), emoticons
+
 
-data = json.loads(open('FORUM.json', 'r').read())
-total = len(list(data['date']))
-results = []
+def fingerprint(entry):
+    """Return hex digest identifying entry by its raw date, place and text."""
+
+    return hashlib.blake2b(f'{entry[0]}\x1f{entry[3]}\x1f{entry[4]}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def clean_entry(entry):
+    """Return cleaned (date, is_report, main_place, place, text, emoticons, fingerprint) row or None if entry is filtered out."""
 
-for entry in zip(list(data['date'].values()), list(data['is_report'].values()), list(data['main_place'].values()), list(data['place'].values()), list(data['text'].values())):
     if len(entry[4]) > 5000:
-        continue
+        return None
     date = entry[0]
     if isinstance(date, str):
-        if re.fullmatch('\d\d.\d\d.\d\d\d\d', date.strip()):
+        if _DATE.fullmatch(date.strip()):
             date = datetime.datetime(int(date.split('.')[2]), int(date.split('.')[1]), int(date.split('.')[0])).timestamp()
         else:
-            continue
+            return None
     else:
         date /= 1000
-    text = entry[4]
-    emoticons = 0
+    text, emoticons = clean_text(entry[4])
+    if text.strip() == '':
+        return None
+    return date, entry[1], entry[2], entry[3], text, emoticons, fingerprint(entry)
+
+
+def clean_chunk(entries):
+    """Return list of cleaned rows from entries, skipping filtered out ones."""
+
+    return [row for row in map(clean_entry, entries) if row is not None]
+
+
+def clean_rows(entries, processes=1, chunk_size=2000):
+    """Yield cleaned rows from entries, skipping filtered out ones.
+
+        With processes > 1 chunks of chunk_size entries are cleaned by a process pool.
+        Rows are yielded in the order of entries and at most 2 * processes chunks are in flight."""
+
+    if processes <= 1:
+        for entry in entries:
+            row = clean_entry(entry)
+            if row is not None:
+                yield row
+        return
+    entries = iter(entries)
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = collections.deque()
+        while True:
+            while len(pending) < 2 * processes:
+                chunk = list(itertools.islice(entries, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(clean_chunk, chunk))
+            if not pending:
+                break
+            yield from pending.popleft().result()
+
+
+def insert_rows(cursor, rows, batch_size=10000, sql=INSERT_SQL):
+    """Insert rows into 'reports' table in batches of batch_size rows by sql and return their number."""
+
+    count = 0
+    rows = iter(rows)
     while True:
-        match = re.search('(<\s*(\/)?\s*[^\s<>"=\/]+(?(2)|(\s+[a-z_-]+(\s*=\s*"[^"]*")?)*)\s*>)|((\s*:\s?[^\Wа-я]+\s?:)|(\:\s?\w+\s?\:|\<[\/\\]?3|[\(\)\\\Dd|\*\$][\-\^]?[\:\;\=]|[\:\;\=B8][\-\^]?[3DdOoPp\@\$\*\\\)\(\/\|])(?=\s|[\!\.\?]|$))', text)
-        if match is not None:
-            text = text.replace(match.group(0), '', 1)
-            if match.group(5):
-                emoticons += 1
-        else:
-            while True:
-                match = re.search(' {2,}', text)
-                if match is not None:
-                    text = text.replace(match.group(0), ' ', 1)
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return count
+        cursor.executemany(sql, batch)
+        count += len(batch)
+
+
+def write_rows(rows, filename, batch_size=10000, fts_columns=(), compressed_columns=(), hashed=False):
+    """Write rows into 'reports' table of a new database in batches of batch_size rows and return number of duplicates,
+        build full-text index over fts_columns and compress compressed_columns if they are specified
+        (see SqlWrapper.compress_column(), the dictionary is trained on the data).
+        With hashed set rows get content hash column and index (see SqlWrapper.create_hash_index()),
+        rows equal to the preceding ones in all columns but the fingerprint are counted as duplicates and skipped.
+
+        The database is built with 'bulk_load' connection profile in a temporary file
+        which replaces filename only after the last batch is committed.
+
+        Raises ValueError if a column is both in fts_columns and compressed_columns."""
+
+    if set(fts_columns) & set(compressed_columns):
+        raise ValueError('Compressed columns can\'t be in full-text index')
+    tmp_filename = filename + '.tmp'
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    conn = sqlite3.connect(tmp_filename)
+    cursor = conn.cursor()
+    for name, value in CONNECTION_PROFILES['bulk_load'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    hash_column = f', {HASH_COLUMN} INTEGER' * hashed
+    cursor.execute(f'CREATE TABLE reports (id INTEGER NOT NULL UNIQUE, date INTEGER NOT NULL, is_report BOOLEAN NOT NULL, main_place TEXT NOT NULL, place TEXT NOT NULL, text TEXT NOT NULL, emoticons INTEGER NOT NULL, {FINGERPRINT_COLUMN} TEXT{hash_column}, PRIMARY KEY (id))')
+    cursor.execute(f'CREATE TABLE {FILTERED_TABLE} (fingerprint TEXT NOT NULL PRIMARY KEY)')
+    duplicates = 0
+
+    def unique_rows():
+        nonlocal duplicates
+        seen = set()
+        for row in rows:
+            row_hash = content_hash(row[:-1], ROW_TYPES)
+            if row_hash in seen:
+                duplicates += 1
+                continue
+            seen.add(row_hash)
+            yield row + (row_hash,)
+
+    if hashed:
+        insert_rows(cursor, unique_rows(), batch_size, HASHED_INSERT_SQL)
+        cursor.execute(f'CREATE INDEX reports_{HASH_COLUMN}_idx ON reports ({HASH_COLUMN})')
+    else:
+        insert_rows(cursor, rows, batch_size)
+    cursor.execute(f'CREATE INDEX reports_fingerprint_idx ON reports ({FINGERPRINT_COLUMN})')
+    conn.commit()
+    conn.close()
+    if fts_columns or compressed_columns:
+        db = SqlWrapper(tmp_filename, True, connection_profile='bulk_load')
+        db.set_table('reports', 'id')
+        if fts_columns:
+            db.create_fts(fts_columns)
+        for column in compressed_columns:
+            db.compress_column(column, dictionary=True)
+        db.commit()
+        if compressed_columns:
+            db.curs.execute('VACUUM')
+        db.close()
+    # commits of 'bulk_load' profile aren't synced, so sync the file before it replaces the old one
+    with open(tmp_filename, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+    return duplicates
+
+
+def _compression_settings(conn):
+    """Return settings of compressed columns stored in the database, see compression.register_functions()."""
+
+    try:
+        return {(table, column): (dictionary or b'', level) for table, column, dictionary, level in conn.execute(
+            f'SELECT table_name, column_name, dictionary, level FROM "{COMPRESSION_TABLE}"')}
+    except sqlite3.OperationalError:
+        return {}
+
+
+def merge_rows(entries, filename, processes=1, batch_size=10000):
+    """Merge entries into existing database and return (inserted, updated) counts.
+
+        Entries are matched to rows by fingerprint(): known entries are skipped without cleaning, or updated if their
+        is_report or main_place has changed, new ones are cleaned and appended. Fingerprints of entries filtered out
+        by cleaning are stored in FILTERED_TABLE, so later merges skip them too. Only the first of repeated entries
+        is merged, fingerprints of merged entries are kept in a temporary table. Values of compressed columns
+        are compressed like SqlWrapper does.
+        All changes are made in one WAL transaction, so readers see the previous state of the database
+        until it's committed.
+
+        Raises ValueError if the database was built without fingerprints."""
+
+    conn = sqlite3.connect(filename)
+    conn.execute('PRAGMA journal_mode = WAL')
+    columns = [c[1] for c in conn.execute('PRAGMA table_info(reports)')]
+    if FINGERPRINT_COLUMN not in columns:
+        conn.close()
+        raise ValueError(f'{filename} has no fingerprints, rebuild it')
+    hashed = HASH_COLUMN in columns
+    settings = _compression_settings(conn)
+    compression.register_functions(conn, settings)
+
+    def value(column):
+        if ('reports', column) in settings:
+            return f"sqlwrapper_compress(?, 'reports', '{column}')"
+        return '?'
+
+    def stored(column):
+        if ('reports', column) in settings:
+            return f"sqlwrapper_decompress({column}, 'reports', '{column}')"
+        return column
+
+    row_columns = ['date', 'is_report', 'main_place', 'place', 'text', 'emoticons', FINGERPRINT_COLUMN] + [HASH_COLUMN] * hashed
+    insert_sql = f'INSERT INTO reports ({", ".join(row_columns)}) VALUES ({", ".join(map(value, row_columns))})'
+    update_sql = f'UPDATE reports SET is_report = {value("is_report")}, main_place = {value("main_place")} WHERE id = ?'
+    conn.execute('CREATE TEMP TABLE merged (fingerprint TEXT NOT NULL PRIMARY KEY)')
+    cursor = conn.cursor()
+    updated = 0
+    # fingerprints of entries being cleaned in their order
+    cleaning = collections.deque()
+
+    def new_entries():
+        nonlocal updated
+        entries_iter = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries_iter, 500))
+            if not chunk:
+                return
+            prints = [fingerprint(e) for e in chunk]
+            params = ", ".join(['?'] * len(prints))
+            known = {f: (i, r, p) for f, i, r, p in conn.execute(
+                f'SELECT {FINGERPRINT_COLUMN}, id, {stored("is_report")}, {stored("main_place")} FROM reports '
+                f'WHERE {FINGERPRINT_COLUMN} IN ({params})', prints)}
+            skipped = {f for (f,) in conn.execute(
+                f'SELECT fingerprint FROM {FILTERED_TABLE} WHERE fingerprint IN ({params}) '
+                f'UNION SELECT fingerprint FROM temp.merged WHERE fingerprint IN ({params})', prints + prints)}
+            conn.executemany('INSERT OR IGNORE INTO temp.merged VALUES (?)', [(f,) for f in prints if f not in skipped])
+            for entry, f in zip(chunk, prints):
+                if f in skipped:
+                    continue
+                skipped.add(f)
+                if f in known:
+                    row_id, is_report, main_place = known[f]
+                    if (is_report, main_place) != (entry[1], entry[2]):
+                        conn.execute(update_sql, (entry[1], entry[2], row_id))
+                        row = clean_entry(entry) if hashed else None
+                        if row is not None:
+                            conn.execute(f'UPDATE reports SET {HASH_COLUMN} = ? WHERE id = ?', (content_hash(row[:-1], ROW_TYPES), row_id))
+                        updated += 1
                 else:
-                    break
-            break
-    if text.strip() == '':
-        continue
-    results.append((date, entry[1], entry[2], entry[3], text, emoticons))
-
-if os.path.exists('reports.db'):
-    os.remove('reports.db')
-conn = sqlite3.connect('reports.db')
-cursor = conn.cursor()
-cursor.execute('CREATE TABLE reports (id INTEGER NOT NULL UNIQUE, date INTEGER NOT NULL, is_report BOOLEAN NOT NULL, main_place TEXT NOT NULL, place TEXT NOT NULL, text TEXT NOT NULL, emoticons INTEGER NOT NULL, PRIMARY KEY (id))')
-cursor.executemany('INSERT INTO reports (date, is_report, main_place, place, text, emoticons) VALUES (?, ?, ?, ?, ?, ?)', results)
-conn.commit()
-conn.close()
+                    cleaning.append(f)
+                    yield entry
+
+    def new_rows():
+        for row in clean_rows(new_entries(), processes):
+            # entries before the row's one were filtered out
+            while cleaning[0] != row[-1]:
+                conn.execute(f'INSERT INTO {FILTERED_TABLE} VALUES (?)', (cleaning.popleft(),))
+            cleaning.popleft()
+            yield row + (content_hash(row[:-1], ROW_TYPES),) * hashed
+        conn.executemany(f'INSERT INTO {FILTERED_TABLE} VALUES (?)', [(f,) for f in cleaning])
+
+    try:
+        inserted = insert_rows(cursor, new_rows(), batch_size, insert_sql)
+        conn.commit()
+    finally:
+        conn.close()
+    return inserted, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert FORUM.json into SQLite database.')
+    parser.add_argument('--source', default='FORUM.json', help='column-oriented JSON dump of the forum')
+    parser.add_argument('--db', default='reports.db', help='database to (re)create or update')
+    parser.add_argument('--batch-size', type=int, default=10000, help='rows per INSERT batch')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes cleaning the text')
+    parser.add_argument('--fts', nargs='*', default=['text'], help='columns of full-text index, none to skip it')
+    parser.add_argument('--compress', nargs='*', default=[], help='columns stored compressed, they can\'t be in full-text index')
+    parser.add_argument('--incremental', action='store_true', help='merge new and changed messages into existing database')
+    parser.add_argument('--content-hash', action='store_true', help='add indexed content hash column and skip duplicate rows')
+    args = parser.parse_args()
+    if set(args.fts) & set(args.compress):
+        parser.error('compressed columns can\'t be in full-text index, use --fts without them')
+    if args.incremental and os.path.exists(args.db):
+        inserted, updated = merge_rows(read_entries(args.source), args.db, args.processes, args.batch_size)
+        print(f'{inserted} rows inserted, {updated} rows updated')
+    else:
+        duplicates = write_rows(clean_rows(read_entries(args.source), args.processes), args.db, args.batch_size, args.fts,
+                                args.compress, args.content_hash)
+        if args.content_hash:
+            print(f'{duplicates} duplicate rows skipped')
+
+
+if __name__ == '__main__':
+    main()
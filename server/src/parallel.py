@@ -0,0 +1,137 @@
+import collections
+import concurrent.futures
+import functools
+import os
+import sqlite3
+import urllib.request
+
+import compression
+
+
+# connection of a pool worker process, opened by _init_worker()
+_connection = None
+
+
+def connect_read_only(filename, settings=None):
+    """Return read-only connection to the database able to read compressed columns described by settings,
+        see compression.register_functions()."""
+
+    uri = 'file:' + urllib.request.pathname2url(os.path.abspath(filename)) + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True)
+    compression.register_functions(conn, settings or {})
+    return conn
+
+
+def pk_ranges(db, chunks):
+    """Return list of up to chunks (first, last) primary key ranges splitting rows of the current table
+        into consecutive parts of almost equal size."""
+
+    length = len(db)
+    chunks = max(1, min(chunks, length))
+    bounds = [length * i // chunks for i in range(chunks + 1)]
+    return [(db._row_id(start), db._row_id(stop - 1)) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+
+
+def _iter_range(conn, sql, first, last, chunk_size):
+    """Yield rows of query with primary key range bound, fetching chunk_size rows at a time."""
+
+    curs = conn.cursor()
+    try:
+        curs.execute(sql, (first, last))
+        while True:
+            rows = curs.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        curs.close()
+
+
+def _process_range(conn, sql, first, last, func, per_row, chunk_size):
+    """Return list of func(row) results for rows of the range if per_row is True, else func(rows)."""
+
+    rows = _iter_range(conn, sql, first, last, chunk_size)
+    if per_row:
+        return [func(row) for row in rows]
+    return func(rows)
+
+
+def _init_worker(filename, settings):
+    """Open read-only connection of a pool worker process."""
+
+    global _connection
+    _connection = connect_read_only(filename, settings)
+
+
+def _run_range(sql, first, last, func, per_row, chunk_size):
+    """Process range by the connection of a pool worker process."""
+
+    return _process_range(_connection, sql, first, last, func, per_row, chunk_size)
+
+
+def _range_sql(db, columns):
+    """Return query selecting columns (all if None) of rows in primary key range given by two parameters."""
+
+    if db.table is None or db.pk is None:
+        raise ValueError
+    if columns is None:
+        select = db._select_sql()
+    else:
+        select = ", ".join([db._column_expr(c) for c in columns])
+    return f'SELECT {select} FROM "{db.table}" WHERE "{db.pk}" BETWEEN ? AND ? ORDER BY "{db.pk}"'
+
+
+def map_ranges(db, func, columns=None, processes=None, chunks=None, per_row=False, chunk_size=1000):
+    """Yield results of func over consecutive primary key ranges of the current table in table order.
+
+        With per_row set func is called with every row and lists of results are yielded, else func is called
+        with an iterator over rows of a range. Ranges are processed by a pool of processes workers (os.cpu_count() by default),
+        every worker reads by its own read-only connection, so only committed changes are seen.
+        The table is split into chunks ranges (4 per process by default) and at most 2 * processes ranges are in flight.
+        func, its arguments and results must be picklable, i.e. func is a module-level function or functools.partial of it.
+
+        Raises ValueError if db.table or db.pk is None."""
+
+    sql = _range_sql(db, columns)
+    processes = processes or os.cpu_count()
+    ranges = pk_ranges(db, chunks or 4 * processes)
+    settings = dict(db._compression)
+    if processes <= 1:
+        conn = connect_read_only(db.filename, settings)
+        try:
+            for first, last in ranges:
+                yield _process_range(conn, sql, first, last, func, per_row, chunk_size)
+        finally:
+            conn.close()
+        return
+    ranges = iter(ranges)
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker,
+                                                initargs=(db.filename, settings)) as executor:
+        pending = collections.deque()
+        while True:
+            while len(pending) < 2 * processes:
+                bounds = next(ranges, None)
+                if bounds is None:
+                    break
+                pending.append(executor.submit(_run_range, sql, *bounds, func, per_row, chunk_size))
+            if not pending:
+                break
+            yield pending.popleft().result()
+
+
+def map_rows(db, func, columns=None, processes=None, chunks=None, chunk_size=1000):
+    """Yield func(row) for every row of the current table in table order, see map_ranges()."""
+
+    for results in map_ranges(db, func, columns, processes, chunks, True, chunk_size):
+        yield from results
+
+
+def aggregate(db, func, combine=None, columns=None, processes=None, chunks=None, chunk_size=1000):
+    """Return partial results of func(rows) over primary key ranges of the current table combined in table order
+        by combine(a, b) (e.g. operator.add for collections.Counter results) or list of them if combine is None,
+        see map_ranges(). Combined result of an empty table is None."""
+
+    results = list(map_ranges(db, func, columns, processes, chunks, False, chunk_size))
+    if combine is None:
+        return results
+    return functools.reduce(combine, results) if results else None
@@ -0,0 +1,144 @@
+import re
+import warnings
+
+
+class ScanWarning(UserWarning):
+    """Warning about a frequently executed query which scans the whole table instead of using an index."""
+
+
+class Query(object):
+    """Lazy filtered query over SqlWrapper's table, built by chaining methods:
+
+        db.where(main_place='Волга', is_report=True).range('date', start, end).order_by('date').limit(100)
+
+        Rows are fetched in chunks only while iterating the query.
+        When the same query with conditions has been run db.scan_warning_threshold times, its plan is checked once
+        and ScanWarning is issued if it scans the table, see SqlWrapper.create_index(). Queries without conditions
+        read the whole table anyway and aren't checked."""
+
+    def __init__(self, db):
+        """Initialize self."""
+
+        self.db = db
+        self._columns = None
+        self._conditions = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = 0
+
+    def where(self, **columns):
+        """Keep rows whose columns are equal to the values, None matches NULL."""
+
+        for column, value in columns.items():
+            self._conditions.append(f'{self.db._column_expr(column)} {"IS" if value is None else "="} ?')
+            self._params.append(value)
+        return self
+
+    def where_in(self, column, values):
+        """Keep rows whose column is equal to one of the values."""
+
+        values = list(values)
+        self._conditions.append(f'{self.db._column_expr(column)} IN ({", ".join(["?"] * len(values))})')
+        self._params.extend(values)
+        return self
+
+    def range(self, column, low=None, high=None):
+        """Keep rows whose column is between low and high inclusive, None leaves that end open."""
+
+        if low is not None:
+            self._conditions.append(f'{self.db._column_expr(column)} >= ?')
+            self._params.append(low)
+        if high is not None:
+            self._conditions.append(f'{self.db._column_expr(column)} <= ?')
+            self._params.append(high)
+        return self
+
+    def order_by(self, column, desc=False):
+        """Order rows by column, rows are ordered by position by default."""
+
+        self._order.append(f'{self.db._column_expr(column)} {"DESC" if desc else "ASC"}')
+        return self
+
+    def limit(self, limit, offset=0):
+        """Return at most limit rows skipping offset first ones."""
+
+        self._limit = limit
+        self._offset = offset
+        return self
+
+    def select(self, *columns):
+        """Return only the specified columns instead of whole rows."""
+
+        self._columns = columns
+        return self
+
+    def sql(self, columns=None):
+        """Return (sql, params) of the query, selecting columns if they are specified."""
+
+        if columns is None:
+            columns = ", ".join([self.db._column_expr(c) for c in self._columns]) if self._columns else self.db._select_sql()
+        sql = f'SELECT {columns} FROM "{self.db.table}"'
+        if self._conditions:
+            sql += f' WHERE {" AND ".join(self._conditions)}'
+        order = self._order + [f'"{self.db.pk}"']
+        sql += f' ORDER BY {", ".join(order)}'
+        if self._limit is not None or self._offset:
+            sql += f' LIMIT {-1 if self._limit is None else int(self._limit)} OFFSET {int(self._offset)}'
+        return sql, list(self._params)
+
+    def explain(self):
+        """Return details of EXPLAIN QUERY PLAN of the query."""
+
+        sql, params = self.sql()
+        return [row[3] for row in self.db.curs.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+    def _check_plan(self, sql, params):
+        """Count runs of query with conditions and warn once if a frequent one scans the table."""
+
+        if not self._conditions:
+            return
+        counts = self.db._query_counts
+        counts[sql] = counts.get(sql, 0) + 1
+        if counts[sql] == self.db.scan_warning_threshold:
+            plan = [row[3] for row in self.db.curs.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            # 'SCAN t' or 'SCAN t USING ...' ('SCAN TABLE t' before SQLite 3.36)
+            scan = re.compile(f'SCAN (?:TABLE )?{re.escape(self.db.table)}(?: .*)?')
+            if any(scan.fullmatch(p) for p in plan):
+                warnings.warn(f'Query run {counts[sql]} times scans table "{self.db.table}": {sql}', ScanWarning, 3)
+
+    def _run(self, columns=None, chunk_size=1000):
+        """Yield rows of the query."""
+
+        if self.db.table is None or self.db.pk is None:
+            raise ValueError
+        sql, params = self.sql(columns)
+        self._check_plan(sql, params)
+        yield from self.db._iter_query(sql, chunk_size, params)
+
+    def __iter__(self):
+        """Return iterator over matching rows."""
+
+        return self._run()
+
+    def positions(self):
+        """Yield positions of matching rows."""
+
+        for (row_id,) in self._run(f'"{self.db.pk}"'):
+            yield self.db._row_position(row_id)
+
+    def first(self):
+        """Return first matching row or None."""
+
+        limit = self._limit
+        self._limit = 1
+        try:
+            return next(self._run(), None)
+        finally:
+            self._limit = limit
+
+    def count(self):
+        """Return number of matching rows."""
+
+        sql, params = self.sql()
+        return self.db.curs.execute(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
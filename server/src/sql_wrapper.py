@@ -1,33 +1,279 @@
+import bisect
+import contextlib
+import hashlib
+import os
+import re
 import sqlite3
+from collections import OrderedDict, namedtuple
 from collections.abc import Iterable
 
+import compression
+from instrumentation import Profile, instrumented_class
+from query import Query
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'size', 'maxsize'])
+TableSchema = namedtuple('TableSchema', ['columns', 'indexes', 'foreign_keys'])
+IndexInfo = namedtuple('IndexInfo', ['columns', 'unique', 'origin'])
+ForeignKey = namedtuple('ForeignKey', ['columns', 'table', 'references', 'on_update', 'on_delete'])
+
+VERSIONS_TABLE = 'sqlwrapper_versions'
+COMPRESSION_TABLE = 'sqlwrapper_compressed'
+# columns named with this prefix are maintained by SqlWrapper or by the tools filling the table and hidden from rows
+HIDDEN_PREFIX = 'sqlwrapper_'
+# hidden column holding content_hash() of the row, see SqlWrapper.create_hash_index()
+HASH_COLUMN = HIDDEN_PREFIX + 'hash'
+
+# PRAGMA settings applied by SqlWrapper.set_connection_profile()
+CONNECTION_PROFILES = {
+    # SQLite defaults: durable commits, 2 MB page cache
+    'safe': {'synchronous': 'FULL', 'cache_size': -2000, 'locking_mode': 'NORMAL', 'temp_store': 'DEFAULT', 'mmap_size': 0,
+             'query_only': 0},
+    # commits are not synced to disk and the database is locked for other connections until the profile is changed
+    'bulk_load': {'synchronous': 'OFF', 'cache_size': -262144, 'locking_mode': 'EXCLUSIVE', 'temp_store': 'MEMORY',
+                  'query_only': 0},
+    # readers don't block and aren't blocked by writers, pages are read through memory map, writes are refused
+    'read_heavy': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -262144, 'mmap_size': 1 << 30,
+                   'query_only': 1},
+}
+
+
+def _literal(value):
+    """Return SQL string literal of value."""
+
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _parse_default(default):
+    """Return column default value from its SQL text given by PRAGMA table_info."""
+
+    if default is None or default.upper() == 'NULL':
+        return None
+    if len(default) > 1 and default[0] == default[-1] and default[0] in '\'"':
+        return default[1:-1].replace(default[0] * 2, default[0])
+    if default.upper() == 'TRUE':
+        return 1
+    if default.upper() == 'FALSE':
+        return 0
+    try:
+        return float(default)
+    except ValueError:
+        return default
+
+
+_TYPE_TAGS = {int: b'i', float: b'f', str: b's', bytes: b'b'}
+_NUMBER = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*')
+
+
+def _affinity(datatype):
+    """Return SQLite type affinity of column declared with datatype."""
+
+    datatype = (datatype or '').upper()
+    if 'INT' in datatype:
+        return 'INTEGER'
+    if 'CHAR' in datatype or 'CLOB' in datatype or 'TEXT' in datatype:
+        return 'TEXT'
+    if 'BLOB' in datatype or not datatype:
+        return 'BLOB'
+    if 'REAL' in datatype or 'FLOA' in datatype or 'DOUB' in datatype:
+        return 'REAL'
+    return 'NUMERIC'
+
+
+def _stored_value(value, affinity):
+    """Return value converted like SQLite stores it in column of affinity, numbers equal in SQL are made equal."""
+
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, str):
+        match = _NUMBER.fullmatch(value) if affinity in ('INTEGER', 'REAL', 'NUMERIC') else None
+        if match is None:
+            return value
+        value = float(value) if match.group(2) or '.' in value else int(value)
+    elif affinity == 'TEXT' and isinstance(value, (int, float)):
+        if isinstance(value, int):
+            return str(value)
+        mantissa, _, exponent = ('%.15g' % value).partition('e')
+        if '.' not in mantissa:
+            mantissa += '.0'
+        return mantissa + 'e' * bool(exponent) + exponent
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def content_hash(values, datatypes=None):
+    """Return 64-bit signed hash of row values.
+
+        Values are converted like SQLite stores them in columns declared with datatypes (by default as given),
+        so rows equal in SQL get equal hashes."""
+
+    if datatypes is None:
+        datatypes = [None] * len(values)
+    return _hash_values(values, [_affinity(t) for t in datatypes])
+
+
+def _hash_values(values, affinities):
+    """Return content_hash() of values stored in columns of affinities."""
+
+    parts = []
+    for value, affinity in zip(values, affinities):
+        value = _stored_value(value, affinity)
+        if value is None:
+            parts.append(b'n')
+            continue
+        data = value if isinstance(value, bytes) else str(value).encode('utf-8', 'surrogatepass')
+        parts.append(b'%s%d:%s' % (_TYPE_TAGS.get(type(value), b'o'), len(data), data))
+    return int.from_bytes(hashlib.blake2b(b''.join(parts), digest_size=8).digest(), 'big', signed=True)
+
+
+class _PositionIndex(object):
+    """Order-statistics index mapping row positions to stored primary keys and back.
+        Keys are kept in ascending order in slots, a Fenwick tree counts live slots, so every operation is O(log n)."""
+
+    def __init__(self, ids):
+        """Initialize self from ascending primary keys."""
+
+        self.ids = list(ids)
+        self.tree = [0] + [1] * len(self.ids)
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+        self.count = len(self.ids)
+
+    def __len__(self):
+        return self.count
+
+    def _prefix(self, slot):
+        """Return count of live slots before slot."""
+
+        result = 0
+        while slot > 0:
+            result += self.tree[slot]
+            slot -= slot & -slot
+        return result
+
+    def next_id(self):
+        """Return primary key for the next appended row."""
+
+        return self.ids[-1] + 1 if self.ids else 1
+
+    def append(self, row_id):
+        """Append primary key greater than all stored ones."""
+
+        self.ids.append(row_id)
+        slot = len(self.ids)
+        self.tree.append(1 + self._prefix(slot - 1) - self._prefix(slot - (slot & -slot)))
+        self.count += 1
+
+    def remove(self, row_id):
+        """Remove primary key."""
+
+        slot = bisect.bisect_left(self.ids, row_id) + 1
+        while slot < len(self.tree):
+            self.tree[slot] -= 1
+            slot += slot & -slot
+        self.count -= 1
+
+    def id(self, pos):
+        """Return primary key of the row at position pos."""
+
+        slot = 0
+        bit = 1 << len(self.tree).bit_length()
+        while bit:
+            if slot + bit < len(self.tree) and self.tree[slot + bit] <= pos:
+                slot += bit
+                pos -= self.tree[slot]
+            bit >>= 1
+        return self.ids[slot]
+
+    def position(self, row_id):
+        """Return position of the row with primary key row_id."""
+
+        return self._prefix(bisect.bisect_left(self.ids, row_id))
+
 
 class SqlWrapper(object):
     """API for sqlite databases similar to built-in list.
         This API is NOT suitable for multi-threading.
-        Using it with multi-threading may lead to errors and data loss, use that way at your own risk."""
+        Using it with multi-threading may lead to errors and data loss, use that way at your own risk
+        or use concurrent_sql_wrapper.ConcurrentSqlWrapper."""
 
-    def __init__(self, filename, store_len):
+    def __init__(self, filename, store_len, sparse_ids=False, cache_size=0, connection_profile=None):
         """Initialize self.
 
             Setting store_len to True switches API into the 'fast mode', meaning row count is fetched only on set_table() call.
             Setting store_len to False switches API into the 'multi-instance mode', meaning that row count is fetched on every __len__() call:
-            it is slower, but suited to work with several instances connected to the same DB at a time."""
+            it is slower, but suited to work with several instances connected to the same DB at a time.
+
+            By default row at index i has primary key i + 1, so deleting a row renumbers all the following ones.
+            Setting sparse_ids to True keeps primary keys of the rows on delete and maps positions to keys with an in-memory index
+            loaded on set_table() call: positional access, append and delete cost O(log n), but the table must not be changed
+            by other instances.
+
+            Setting cache_size to a positive number keeps up to cache_size rows read by index in LRU cache.
+            The cache is invalidated by the changes made through this instance only, don't use it with several writing instances.
 
-        self.conn = sqlite3.connect(filename)
+            connection_profile is the name of CONNECTION_PROFILES item applied to the connection, see set_connection_profile()."""
+
+        self.filename = filename
+        self.closed = False
+        self._compression = {}
+        self._compressed = frozenset()
+        self.conn = self._connect()
         self.curs = self.conn.cursor()
         self.table = None
         self.pk = None
         self.store_len = store_len
         self.columns = ()
         self.column_names = ()
+        self._hashed = False
+        self._hidden = False
+        self._affinities = []
         self._len = 0
+        self._insert_layouts = {}
+        self._schemas = {}
+        self.sparse_ids = sparse_ids
+        self._positions = None
+        self.scan_warning_threshold = 10
+        self._query_counts = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+        self.profile = None
+        self._deferred_indexes = []
+        if connection_profile is not None:
+            self.set_connection_profile(connection_profile)
+
+    def _connect(self):
+        """Return new connection to the database."""
+
+        conn = sqlite3.connect(self.filename)
+        self._register_functions(conn)
+        return conn
+
+    def _register_functions(self, conn):
+        """Register SQL functions compressing and decompressing values of compressed columns on connection."""
+
+        compression.register_functions(conn, self._compression)
+
+    def _open_connections(self):
+        """Return list of open connections to the database."""
+
+        return [self.conn]
+
+    def _cursor(self):
+        """Return new cursor of self.conn."""
+
+        return self.conn.cursor()
 
     def __del__(self):
         """Commit changes and close database connection on object destruction."""
 
-        self.conn.commit()
-        self.conn.close()
+        self.close()
 
     def __len__(self):
         """Return table's row count.
@@ -36,6 +282,8 @@ class SqlWrapper(object):
 
         if self.table is None or self.pk is None:
             raise ValueError
+        if self.sparse_ids:
+            return len(self._positions)
         if self.store_len:
             return self._len
         else:
@@ -50,38 +298,126 @@ class SqlWrapper(object):
 
         if self.table is None or self.pk is None:
             raise ValueError
-        if self.__len__() == 0:
+        if isinstance(idx, int) and idx in self._cache:
+            return self._cache_hit(idx)
+        length = self.__len__()
+        if length == 0:
             return None
         if isinstance(idx, int):
-            if idx >= self.__len__() or idx < -self.__len__():
+            if idx >= length or idx < -length:
                 raise IndexError
-            if -self.__len__() <= idx < 0:
-                idx += self.__len__()
-            return self.curs.execute(f'SELECT * FROM "{self.table}" WHERE "{self.pk}" = {idx + 1}').fetchone()
+            if idx < 0:
+                idx += length
+                if idx in self._cache:
+                    return self._cache_hit(idx)
+            row = self.curs.execute(f'SELECT {self._select_sql()} FROM "{self.table}" WHERE "{self.pk}" = {self._row_id(idx)}').fetchone()
+            if self.cache_size > 0:
+                self._cache_put(idx, row)
+            return row
         elif isinstance(idx, slice):
-            start = idx.start
-            stop = idx.stop
-            if start is None:
-                start = 0
-            if stop is None:
-                stop = self.__len__()
-            if start >= self.__len__():
-                return []
-            if start < 0:
-                start += self.__len__()
-            while stop < 0:
-                stop += self.__len__()
-            if start >= stop:
-                return []
-            return self.curs.execute(
-                f'SELECT * FROM "{self.table}" WHERE "{self.pk}" BETWEEN {start + 1} AND {stop}'
-            ).fetchall()[::idx.step]
+            sql = self._slice_sql(idx, length)
+            return self.curs.execute(sql).fetchall() if sql else []
         elif isinstance(idx, Iterable):
-            rows = ['"' + i.strip() + '"' for i in idx if i.strip()]
-            return self.curs.execute(f'SELECT {", ".join(rows)} FROM "{self.table}"').fetchall()
+            return self.curs.execute(self._columns_sql(idx)).fetchall()
         else:
             raise TypeError
 
+    def __iter__(self):
+        """Return iterator over table rows fetched by a single query in chunks."""
+
+        return self.iter_rows()
+
+    def _slice_sql(self, idx, length):
+        """Return query selecting rows by slice with step applied in SQL or None if slice is empty.
+            Slices select the same positions as they do from a list of length rows."""
+
+        positions = range(length)[idx]
+        if not positions:
+            return None
+        step = positions.step
+        order = "ASC" if step > 0 else "DESC"
+        if self.sparse_ids:
+            columns = ", ".join(['"' + c + '"' for c in self.column_names])
+            first, last = self._row_id(min(positions)), self._row_id(max(positions))
+            if abs(step) == 1:
+                return f'SELECT {self._select_sql()} FROM "{self.table}" WHERE "{self.pk}" BETWEEN {first} AND {last} ORDER BY "{self.pk}" {order}'
+            return (f'SELECT {columns} FROM (SELECT {self._select_sql()}, ROW_NUMBER() OVER (ORDER BY "{self.pk}" {order}) - 1 AS _position '
+                    f'FROM "{self.table}" WHERE "{self.pk}" BETWEEN {first} AND {last}) WHERE _position % {abs(step)} = 0 ORDER BY _position')
+        # ids of dense table are positions + 1
+        first = positions[0] + 1
+        where = f'"{self.pk}" BETWEEN {min(positions) + 1} AND {max(positions) + 1}'
+        if abs(step) != 1:
+            where += f' AND abs("{self.pk}" - {first}) % {abs(step)} = 0'
+        return f'SELECT {self._select_sql()} FROM "{self.table}" WHERE {where} ORDER BY "{self.pk}" {order}'
+
+    def _columns_sql(self, columns):
+        """Return query selecting columns of all rows."""
+
+        columns = [self._column_expr(i.strip()) for i in columns if i.strip()]
+        return f'SELECT {", ".join(columns)} FROM "{self.table}" ORDER BY "{self.pk}"'
+
+    def _column_expr(self, column, prefix=''):
+        """Return SQL expression reading column of the table, decompressing it if it's compressed."""
+
+        if column in self._compressed:
+            return f'sqlwrapper_decompress({prefix}"{column}", {_literal(self.table)}, {_literal(column)})'
+        return f'{prefix}"{column}"'
+
+    def _select_sql(self, prefix=''):
+        """Return SQL list of all columns of the table, decompressing compressed ones."""
+
+        if not self._compressed and not self._hidden:
+            return prefix + '*'
+        return ", ".join([self._column_expr(c, prefix) + f' AS "{c}"' * (c in self._compressed) for c in self.column_names])
+
+    def _value_sql(self, column):
+        """Return SQL placeholder for value of column, compressing it if column is compressed."""
+
+        if column in self._compressed:
+            return f'sqlwrapper_compress(?, {_literal(self.table)}, {_literal(column)})'
+        return '?'
+
+    def _iter_query(self, sql, chunk_size, params=()):
+        """Yield rows of query fetched in chunks by a separate cursor."""
+
+        curs = self._cursor()
+        try:
+            curs.execute(sql, params)
+            while True:
+                rows = curs.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            curs.close()
+
+    def iter_rows(self, idx=slice(None), chunk_size=1000):
+        """Yield row tuples selected by slice, fetching chunk_size rows at a time.
+            Memory usage doesn't depend on slice length.
+
+            Raises TypeError if idx is not a slice,
+            ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        if not isinstance(idx, slice):
+            raise TypeError
+        sql = self._slice_sql(idx, self.__len__())
+        if sql:
+            yield from self._iter_query(sql, chunk_size)
+
+    def iter_columns(self, columns, chunk_size=1000):
+        """Yield tuples of the specified columns of all rows, fetching chunk_size rows at a time.
+
+            Raises TypeError if columns is not an iterable,
+            ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        if not isinstance(columns, Iterable):
+            raise TypeError
+        yield from self._iter_query(self._columns_sql(columns), chunk_size)
+
     def __setitem__(self, idx, row):
         """Update table row to passed dictionary, list or tuple by index.
 
@@ -111,8 +447,14 @@ class SqlWrapper(object):
                 row = res_row
                 if '"' + self.pk + '"' in list(row):
                     del row['"' + self.pk + '"']
+                if self._hashed:
+                    values = {k[1:-1]: v for k, v in row.items()}
+                    if not all(c in values for c in self.column_names if c != self.pk):
+                        values = {**dict(zip(self.column_names, self.__getitem__(idx))), **values}
+                    row['"' + HASH_COLUMN + '"'] = self._row_hash(values)
                 self.curs.execute(
-                    f'UPDATE "{self.table}" SET {", ".join([f"{list(row)[i]} = ?" for i in range(len(row))])} WHERE "{self.pk}" = {idx + 1}', [i for i in row.values()])
+                    f'UPDATE "{self.table}" SET {", ".join([f"{list(row)[i]} = {self._value_sql(list(row)[i][1:-1])}" for i in range(len(row))])} WHERE "{self.pk}" = {self._row_id(idx)}', [i for i in row.values()])
+                self._cache.pop(idx, None)
             else:
                 raise TypeError
         else:
@@ -128,9 +470,21 @@ class SqlWrapper(object):
             raise ValueError
         if self.__len__() == 0:
             return
-        start = 0
-        stop = self.__len__()
-        step = 1
+        if self.sparse_ids:
+            if isinstance(idx, int):
+                if idx >= self.__len__() or idx < -self.__len__():
+                    raise IndexError
+                ids = [self._positions.id(idx % self.__len__())]
+            elif isinstance(idx, slice):
+                ids = [self._positions.id(i) for i in range(self.__len__())[idx]]
+            else:
+                raise TypeError
+            if ids:
+                self._invalidate(self._positions.position(min(ids)))
+            self.curs.executemany(f'DELETE FROM "{self.table}" WHERE "{self.pk}" = ?', [(i,) for i in ids])
+            for i in ids:
+                self._positions.remove(i)
+            return
         if isinstance(idx, int):
             if idx >= self.__len__() or idx < -self.__len__():
                 raise IndexError
@@ -138,29 +492,22 @@ class SqlWrapper(object):
                 idx += self.__len__()
             self.curs.execute(f'DELETE FROM "{self.table}" WHERE "{self.pk}" = {idx + 1}')
         elif isinstance(idx, slice):
-            if idx.start is not None:
-                start = idx.start
-            if idx.stop is not None:
-                stop = idx.stop
-            if idx.step is not None:
-                step = idx.step
-            if start >= self.__len__():
-                return []
-            if start < 0:
-                start += self.__len__()
-            while stop < 0:
-                stop += self.__len__()
-            if start >= stop:
+            positions = range(self.__len__())[idx]
+            if not positions:
                 return []
+            if positions.step < 0:
+                positions = positions[::-1]
+            start, stop, step = positions[0], positions[-1] + 1, positions.step
             self.curs.execute(
                 f'DELETE FROM "{self.table}" WHERE "{self.pk}" - 1 BETWEEN {start} AND {stop - 1} AND ("{self.pk}" - 1) % {step} = {start % step}')
         else:
             raise TypeError
+        self._len -= self.curs.rowcount
         if isinstance(idx, int):
-            start = idx
+            start, stop, step = idx, idx + 1, 1
+        self._invalidate(start)
         self.curs.execute(
             f'UPDATE "{self.table}" SET "{self.pk}" = "{self.pk}" - ("{self.pk}" - ("{self.pk}" > {stop}) * ("{self.pk}" - {stop}) - {start} - 1) / {step} - 1 WHERE "{self.pk}" > {start}')
-        self._len = self.curs.rowcount
         self._update_sequence()
 
     def __enter__(self):
@@ -168,15 +515,196 @@ class SqlWrapper(object):
 
         return self
 
-    def __exit__(self):
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
         """Commit changes and close database connection when exiting 'with ... as' statement."""
 
+        self.close()
+
+    def close(self):
+        """Commit changes, rebuild indexes dropped by 'bulk_load' profile and close database connection,
+            if it's not closed yet."""
+
+        if not self.closed:
+            self.conn.commit()
+            self._build_deferred_indexes()
+            self.conn.close()
+            self.closed = True
+
+    def _row_id(self, pos):
+        """Return primary key of the row at non-negative position pos."""
+
+        if self.sparse_ids:
+            return self._positions.id(pos)
+        return pos + 1
+
+    def _row_position(self, row_id):
+        """Return position of the row with primary key row_id."""
+
+        if self.sparse_ids:
+            return self._positions.position(row_id)
+        return row_id - 1
+
+    def _cache_hit(self, pos):
+        """Return cached row at position pos and mark it as recently used."""
+
+        self._cache_hits += 1
+        self._cache.move_to_end(pos)
+        return self._cache[pos]
+
+    def _cache_put(self, pos, row):
+        """Cache row at position pos evicting the least recently used row if the cache is full."""
+
+        self._cache_misses += 1
+        self._cache[pos] = row
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            self._cache_evictions += 1
+
+    def _invalidate(self, start=0):
+        """Drop cached rows at positions from start, which are shifted by delete."""
+
+        if start <= 0:
+            self._cache.clear()
+        else:
+            for pos in [p for p in self._cache if p >= start]:
+                del self._cache[pos]
+
+    def cache_info(self):
+        """Return CacheInfo(hits, misses, evictions, size, maxsize) of the row cache."""
+
+        return CacheInfo(self._cache_hits, self._cache_misses, self._cache_evictions, len(self._cache), self.cache_size)
+
+    def cache_clear(self):
+        """Clear the row cache and its statistics."""
+
+        self._cache.clear()
+        self._cache_hits = self._cache_misses = self._cache_evictions = 0
+
+    def get_pragmas(self, names):
+        """Return dictionary mapping names of PRAGMA settings to their current values."""
+
+        return {name: self.curs.execute(f'PRAGMA {name}').fetchone()[0] for name in names}
+
+    def set_pragmas(self, pragmas):
+        """Apply PRAGMA settings from dictionary mapping their names to values.
+            Switching persistent journal mode back from WAL is skipped while other connections use the database."""
+
+        for name, value in pragmas.items():
+            try:
+                self.curs.execute(f'PRAGMA {name} = {value}')
+            except sqlite3.OperationalError:
+                if name != 'journal_mode':
+                    raise
+            if name == 'locking_mode':
+                # exclusive lock is released by the next access to the database
+                self.curs.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+    def set_connection_profile(self, name):
+        """Commit the current transaction, apply PRAGMA settings of the profile from CONNECTION_PROFILES
+            and return dictionary of previous values of these settings, which set_pragmas() restores.
+
+            'bulk_load' profile also drops non-unique indexes of the current table,
+            they are rebuilt at once when another profile is applied or the connection is closed.
+
+            Raises ValueError if there is no such profile."""
+
+        if name not in CONNECTION_PROFILES:
+            raise ValueError
         self.conn.commit()
-        self.conn.close()
+        self._build_deferred_indexes()
+        pragmas = CONNECTION_PROFILES[name]
+        # restored in reverse order, so query_only is cleared before journal mode is changed
+        previous = self.get_pragmas(list(pragmas)[::-1])
+        self.set_pragmas(pragmas)
+        if name == 'bulk_load' and self.table is not None:
+            indexes = self.schema(self.table).indexes
+            for index, sql in self.curs.execute('SELECT name, sql FROM sqlite_master WHERE type = "index" AND tbl_name = ? AND sql IS NOT NULL',
+                                                (self.table,)).fetchall():
+                if not indexes[index].unique:
+                    self.curs.execute(f'DROP INDEX "{index}"')
+                    self._deferred_indexes.append(sql)
+            self.conn.commit()
+            self.schema_clear(self.table)
+        return previous
+
+    def _build_deferred_indexes(self):
+        """Create indexes dropped by 'bulk_load' profile."""
+
+        if self._deferred_indexes:
+            for sql in self._deferred_indexes:
+                self.curs.execute(sql)
+            self._deferred_indexes = []
+            self.conn.commit()
+            self.schema_clear()
+
+    @contextlib.contextmanager
+    def connection_profile(self, name):
+        """Return context manager applying the profile (see set_connection_profile()) inside the block
+            and restoring the previous settings after it.
+            Changes made in the block are committed at its end or rolled back if it raises an exception.
+
+                with db.connection_profile('bulk_load'):
+                    db.extend(rows)"""
+
+        previous = self.set_connection_profile(name)
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        finally:
+            self.conn.commit()
+            self._build_deferred_indexes()
+            self.set_pragmas(previous)
+
+    def instrument(self, profile=None, slow_query_threshold=None, trace=None):
+        """Start recording calls of list methods and executed statements into profile and return it.
+
+            If profile is None, new Profile(slow_query_threshold, trace) is created, see instrumentation.Profile.
+            Instrumentation is switched on by changing the class of self, so it costs nothing until then.
+            Switch it on and off while no other thread uses self."""
+
+        if profile is None:
+            profile = Profile(slow_query_threshold, trace)
+        cls = getattr(type(self), '_original_class', type(self))
+        self.profile = profile
+        self.__class__ = instrumented_class(cls)
+        for conn in self._open_connections():
+            conn.set_trace_callback(profile.trace)
+        return profile
+
+    def uninstrument(self):
+        """Stop recording started by instrument() and return the profile or None if it wasn't started."""
+
+        profile = self.profile
+        if profile is not None:
+            self.__class__ = self._original_class
+            for conn in self._open_connections():
+                conn.set_trace_callback(None)
+            self.profile = None
+        return profile
+
+    @contextlib.contextmanager
+    def profiling(self, slow_query_threshold=None, trace=None):
+        """Return context manager recording the block into new Profile, which is returned by 'with ... as' statement.
+
+            The previous profile, if any, is resumed after the block."""
+
+        previous = self.profile
+        profile = self.instrument(None, slow_query_threshold, trace)
+        try:
+            yield profile
+        finally:
+            if previous is None:
+                self.uninstrument()
+            else:
+                self.instrument(previous)
 
     def _update_sequence(self):
         """Update 'sqlite_sequence' to sync table's primary key to its length."""
 
+        if self.sparse_ids:
+            return
         try:
             self.curs.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?', (self._len, self.table))
         except sqlite3.OperationalError:
@@ -191,67 +719,158 @@ class SqlWrapper(object):
         """Roll back any changes to the database since the last call to commit()."""
 
         self.conn.rollback()
+        self._cache.clear()
+        self.schema_clear()
+        self._load_compression()
+        if self.table is not None and self.pk is not None:
+            self._load_len()
+
+    def schema(self, table_name):
+        """Return TableSchema(columns, indexes, foreign_keys) of the specified table or None if it doesn't exist.
+
+            columns is a list of [column_name, datatype, not_null, unique, primary_key, default] like create_table() takes,
+            indexes maps index names to IndexInfo(columns, unique, origin),
+            foreign_keys is a list of ForeignKey(columns, table, references, on_update, on_delete).
+            Schema is read by PRAGMA statements once and cached until it's changed by this instance,
+            call schema_clear() after changing it through other connections."""
+
+        if table_name in self._schemas:
+            return self._schemas[table_name]
+        info = self.curs.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+        if not info:
+            return None
+        indexes = {}
+        for _, name, unique, origin, _ in self.curs.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+            columns = [c[2] for c in self.curs.execute(f'PRAGMA index_info("{name}")').fetchall()]
+            indexes[name] = IndexInfo(columns, bool(unique), origin)
+        unique_columns = {i.columns[0] for i in indexes.values() if i.origin == 'u' and len(i.columns) == 1}
+        columns = [[name, datatype.upper(), bool(not_null), name in unique_columns, pk > 0, _parse_default(default)]
+                   for _, name, datatype, not_null, default, pk in info]
+        foreign_keys = {}
+        for key_id, _, table, column, reference, on_update, on_delete, _ in self.curs.execute(
+                f'PRAGMA foreign_key_list("{table_name}")').fetchall():
+            key = foreign_keys.setdefault(key_id, ForeignKey([], table, [], on_update, on_delete))
+            key.columns.append(column)
+            key.references.append(reference)
+        self._schemas[table_name] = TableSchema(columns, indexes, list(foreign_keys.values()))
+        return self._schemas[table_name]
+
+    def schema_clear(self, table_name=None):
+        """Drop cached schema of the specified table or of all tables and reload columns of the current table."""
+
+        if table_name is None:
+            self._schemas.clear()
+        else:
+            self._schemas.pop(table_name, None)
+        if self.table is not None and table_name in (None, self.table):
+            schema = self.schema(self.table)
+            if schema is not None:
+                self._load_columns()
 
     def get_table_columns(self, table_name):
-        """Get columns info of the specified table."""
+        """Get columns info of the specified table: [[column_name, datatype, not_null, unique, primary_key, default], ...]
+            or None if it doesn't exist."""
 
-        result = []
-        columns = self.curs.execute(f'SELECT sql FROM sqlite_master WHERE type = "table" AND tbl_name = ?', (table_name,)).fetchone()
-        if columns is None:
+        schema = self.schema(table_name)
+        if schema is None:
             return None
-        columns = columns[0].split('(', 1)[1].rsplit(')', 1)[0].split(',')
-        columns = [i.strip() for i in columns]
-        for i1 in range(len(columns)):
-            c = columns[i1]
-            if c.split('(')[0].upper() == 'PRIMARY KEY':
-                result = [(lambda col: [col[0], col[1], col[2], col[3], True, col[5]] if col[0] == c.split('(')[1].split(')')[0][1:-1] else col)(col) for col in result]
-                continue
-            c = columns[i1].split()
-            result.append(['', '', False, False, False, None])
-            for i2 in range(len(c)):
-                attr = c[i2]
-                if i2 == 0:
-                    if attr.find('"') != -1:
-                        result[i1][0] = attr[1:-1]
-                    else:
-                        result[i1][0] = attr
-                elif i2 == 1:
-                    result[i1][1] = attr.upper()
-                else:
-                    if attr.upper() == 'NOT' and c[i2 + 1].upper() == 'NULL':
-                        result[i1][2] = True
-                    elif attr.upper() == 'UNIQUE':
-                        result[i1][3] = True
-                    elif attr.upper() == 'PRIMARY' and c[i2 + 1].upper() == 'KEY':
-                        result[i1][4] = True
-                    elif i2 == len(c) - 1 and c[i2 - 1].upper() == 'DEFAULT':
-                        if attr.upper() == 'NULL':
-                            result[i1][5] = None
-                        elif attr.find('"') != -1:
-                            result[i1][5] = attr[1:-1]
-                        elif attr.upper() == 'TRUE':
-                            result[i1][5] = 1
-                        elif attr.upper() == 'FALSE':
-                            result[i1][5] = 0
-                        else:
-                            try:
-                                float(attr)
-                            except ValueError:
-                                result[i1][5] = attr
-                            else:
-                                result[i1][5] = float(attr)
-        return result
+        return [list(c) for c in schema.columns]
 
     def set_table(self, table_name, pk):
-        """Set table and primary key. Set self._len if in 'fast mode'."""
+        """Set table and primary key. Set self._len if in 'fast mode' or load position index if in sparse ids mode."""
 
         self.table = table_name
         self.pk = pk
-        self.columns = self.get_table_columns(self.table)
+        self._load_columns()
+        self._cache.clear()
+        self._load_compression()
+        self._load_len()
+
+    def _load_columns(self):
+        """Load columns of the table except hidden ones named with HIDDEN_PREFIX, such as HASH_COLUMN."""
+
+        columns = self.get_table_columns(self.table)
+        self._hashed = any(c[0] == HASH_COLUMN for c in columns)
+        self.columns = [c for c in columns if not c[0].startswith(HIDDEN_PREFIX)]
+        self._hidden = len(self.columns) < len(columns)
         self.column_names = [c[0] for c in self.columns]
-        if self.store_len:
+        self._affinities = [_affinity(c[1]) for c in self.columns if c[0] != self.pk]
+        self._insert_layouts = {}
+
+    def _load_compression(self):
+        """Load settings of compressed columns from COMPRESSION_TABLE."""
+
+        self._compression.clear()
+        try:
+            for table, column, dictionary, level in self.curs.execute(
+                    f'SELECT table_name, column_name, dictionary, level FROM "{COMPRESSION_TABLE}"').fetchall():
+                self._compression[(table, column)] = (dictionary or b'', level)
+        except sqlite3.OperationalError:
+            pass
+        self._compressed = frozenset(c for (t, c) in self._compression if t == self.table)
+        self._insert_layouts = {}
+
+    def _load_len(self):
+        """Fetch self._len if in 'fast mode' and position index if in sparse ids mode."""
+
+        if self.sparse_ids:
+            self._positions = _PositionIndex(i for (i,) in self.curs.execute(f'SELECT "{self.pk}" FROM "{self.table}" ORDER BY "{self.pk}"'))
+        elif self.store_len:
             self._len = self.curs.execute(f'SELECT COUNT("{self.pk}") FROM "{self.table}"').fetchone()[0]
 
+    def _row_values(self, row):
+        """Return values of non-pk columns of dictionary, list or tuple row in table order, missing ones set to defaults."""
+
+        if isinstance(row, dict):
+            return [row[c[0]] if c[0] in row else c[5] for c in self.columns if c[0] != self.pk]
+        return [row[i] if i < len(row) else c[5] for i, c in enumerate(self.columns) if c[0] != self.pk]
+
+    def _row_hash(self, row):
+        """Return content_hash() of dictionary, list or tuple row stored in HASH_COLUMN."""
+
+        return _hash_values(self._row_values(row), self._affinities)
+
+    def _match_sql(self, row):
+        """Return (condition, params) selecting rows equal to dictionary, list or tuple row in its non-pk columns.
+            If row has all the columns and the table has HASH_COLUMN, the condition is resolved by its index."""
+
+        if isinstance(row, dict):
+            values = {k: v for k, v in row.items() if k != self.pk}
+        else:
+            values = {self.column_names[i]: row[i] for i in range(len(row)) if self.column_names[i] != self.pk}
+        conditions = [self._column_expr(c) + (" IS ?" if v is None else " = ?") for c, v in values.items()]
+        params = list(values.values())
+        if self._hashed and all(c in values for c in self.column_names if c != self.pk):
+            conditions.insert(0, f'"{HASH_COLUMN}" = ?')
+            params.insert(0, self._row_hash(values))
+        return " AND ".join(conditions), params
+
+    def _insert_layout(self, row):
+        """Return (sql, key) inserting rows shaped like row and key extracting their values.
+
+            Rows are shaped alike if they are dictionaries with the same keys or lists/tuples of the same length.
+            In sparse ids mode sql expects primary key before the values."""
+
+        layout = tuple(row) if isinstance(row, dict) else len(row)
+        if layout not in self._insert_layouts:
+            if isinstance(row, dict):
+                keys = [k for k in row if k != self.pk]
+                names = keys
+            else:
+                keys = [i for i in range(len(row)) if self.column_names[i] != self.pk]
+                names = [self.column_names[i] for i in keys]
+            if self.sparse_ids:
+                names = [self.pk] + names
+            if self._hashed:
+                names = names + [HASH_COLUMN]
+            columns = ", ".join(['"' + n + '"' for n in names])
+            sql = f'INSERT INTO "{self.table}" ({columns}) VALUES ({", ".join([self._value_sql(n) for n in names])})'
+            if self._hashed:
+                self._insert_layouts[layout] = (sql, lambda r: [r[k] for k in keys] + [self._row_hash(r)])
+            else:
+                self._insert_layouts[layout] = (sql, lambda r: [r[k] for k in keys])
+        return self._insert_layouts[layout]
+
     def append(self, row):
         """Insert row into table from passed dictionary, list or tuple.
 
@@ -264,38 +883,69 @@ class SqlWrapper(object):
         if self.table is None or self.pk is None or not row:
             raise ValueError
         if isinstance(row, dict) or isinstance(row, list) or isinstance(row, tuple):
-            res_row = {}
-            if isinstance(row, dict):
-                for i in range(len(row)):
-                    res_row.update({'"' + list(row)[i] + '"': list(row.values())[i]})
+            sql, key = self._insert_layout(row)
+            if self.sparse_ids:
+                row_id = self._positions.next_id()
+                self.curs.execute(sql, [row_id] + key(row))
+                self._positions.append(row_id)
             else:
-                for i in range(len(row)):
-                    res_row.update({'"' + self.column_names[i] + '"': row[i]})
-            row = res_row
-            if '"' + self.pk + '"' in list(row):
-                del row['"' + self.pk + '"']
-            self.curs.execute(
-                f'INSERT INTO "{self.table}" ({", ".join([str(list(row)[i]) for i in range(len(row))])}) VALUES ({", ".join(["?"] * len(row))})', [i for i in row.values()])
+                self.curs.execute(sql, key(row))
         else:
             raise TypeError
         self._len += 1
         self._update_sequence()
 
-    def extend(self, rows):
-        """Insert rows into table.
+    def extend(self, rows, batch_size=10000):
+        """Insert rows from any iterable and return the number of inserted rows.
+
+            Rows are streamed into executemany() in batches of batch_size rows shaped alike (see append()),
+            all within the current transaction. Row count and 'sqlite_sequence' are updated once at the end.
 
             Raises TypeError if rows is not an iterable,
-            ValueError if self.table or self.pk is None."""
+            if row is not a dictionary, list or tuple,
+            ValueError if self.table or self.pk is None,
+            if row iterable is empty.
+            Rows preceding the wrong one stay inserted, call rollback() to discard them."""
 
         if self.table is None or self.pk is None:
             raise ValueError
         if not isinstance(rows, Iterable):
             raise TypeError
-        rows = list(rows)
-        for row in rows:
-            if not isinstance(row, dict) and not isinstance(row, list) and not isinstance(row, tuple):
-                raise TypeError
-            self.append(row)
+        count = 0
+        sql = None
+        batch = []
+
+        def flush():
+            nonlocal count
+            self.curs.executemany(sql, batch)
+            if self.sparse_ids:
+                for values in batch:
+                    self._positions.append(values[0])
+            count += len(batch)
+
+        try:
+            for row in rows:
+                if not isinstance(row, dict) and not isinstance(row, list) and not isinstance(row, tuple):
+                    raise TypeError
+                if not row:
+                    raise ValueError
+                row_sql, key = self._insert_layout(row)
+                if row_sql != sql or len(batch) >= batch_size:
+                    if batch:
+                        flush()
+                    sql = row_sql
+                    batch = []
+                if self.sparse_ids:
+                    batch.append([self._positions.next_id() + len(batch)] + key(row))
+                else:
+                    batch.append(key(row))
+            if batch:
+                flush()
+        finally:
+            if count:
+                self._len += count
+                self._update_sequence()
+        return count
 
     def pop(self, idx=-1):
         """Remove and return row at index (default last).
@@ -308,8 +958,6 @@ class SqlWrapper(object):
         if isinstance(idx, int):
             row = self.__getitem__(idx)
             self.__delitem__(idx)
-            self._len -= 1
-            self._update_sequence()
             return row
         else:
             raise TypeError
@@ -325,22 +973,20 @@ class SqlWrapper(object):
         if self.table is None or self.pk is None or not row:
             raise ValueError
         if isinstance(row, dict) or isinstance(row, list) or isinstance(row, tuple):
-            res_row = {}
-            if isinstance(row, dict):
-                for i in range(len(row)):
-                    res_row.update({'"' + list(row)[i] + '"': list(row.values())[i]})
-            else:
-                for i in range(len(row)):
-                    res_row.update({'"' + self.column_names[i] + '"': row[i]})
-            if '"' + self.pk + '"' in list(res_row):
-                del res_row['"' + self.pk + '"']
-            row = res_row
-            index = self.curs.execute(f'SELECT "{self.pk}" FROM "{self.table}" WHERE {" AND ".join([list(row)[i] + " " + (lambda v: "IS" if v is None else "=")(list(row.values())[i]) + " ?" for i in range(len(row))])} ORDER BY "{self.pk}" ASC LIMIT 1', [i for i in row.values()]).fetchone()
+            condition, params = self._match_sql(row)
+            index = self.curs.execute(f'SELECT "{self.pk}" FROM "{self.table}" WHERE {condition} ORDER BY "{self.pk}" ASC LIMIT 1', params).fetchone()
             if index:
                 index = index[0]
             else:
                 raise ValueError
+            if self.sparse_ids:
+                self._invalidate(self._positions.position(index))
+            else:
+                self._invalidate(index - 1)
             self.curs.execute(f'DELETE FROM "{self.table}" WHERE "{self.pk}" = {index}')
+            if self.sparse_ids:
+                self._positions.remove(index)
+                return
             self.curs.execute(f'UPDATE "{self.table}" SET "{self.pk}" = "{self.pk}" - 1 WHERE "{self.pk}" > {index}')
         else:
             raise TypeError
@@ -362,19 +1008,19 @@ class SqlWrapper(object):
                 if isinstance(row, dict) or isinstance(row, list) or isinstance(row, tuple):
                     if start >= stop:
                         raise ValueError
-                    res_row = {}
-                    if isinstance(row, dict):
-                        for i in range(len(row)):
-                            res_row.update({'"' + list(row)[i] + '"': list(row.values())[i]})
+                    if self.sparse_ids:
+                        positions = range(self.__len__())[start:stop]
+                        if not positions:
+                            raise ValueError
+                        first, last = self._row_id(positions[0]), self._row_id(positions[-1])
                     else:
-                        for i in range(len(row)):
-                            res_row.update({'"' + self.column_names[i] + '"': row[i]})
-                    if '"' + self.pk + '"' in list(res_row):
-                        del res_row['"' + self.pk + '"']
-                    row = res_row
+                        first, last = start + 1, stop
+                    condition, params = self._match_sql(row)
                     index = self.curs.execute(
-                        f'SELECT "{self.pk}" FROM "{self.table}" WHERE {" AND ".join([list(row)[i] + " " + (lambda v: "IS" if v is None else "=")(list(row.values())[i]) + " ?" for i in range(len(row))])} AND "{self.pk}" BETWEEN {start + 1} AND {stop} LIMIT 1', [i for i in row.values()]).fetchone()
-                    if index:
+                        f'SELECT "{self.pk}" FROM "{self.table}" WHERE {condition} AND "{self.pk}" BETWEEN {first} AND {last} ORDER BY "{self.pk}" LIMIT 1', params).fetchone()
+                    if index and self.sparse_ids:
+                        return self._positions.position(index[0])
+                    elif index:
                         return index[0] - 1
                     else:
                         raise ValueError
@@ -385,6 +1031,33 @@ class SqlWrapper(object):
         else:
             raise TypeError
 
+    def count(self, row):
+        """Return number of occurrences of row.
+
+            Raises TypeError if row is not a dictionary,
+            ValueError if self.table or self.pk is None,
+            if row iterable is empty."""
+
+        if self.table is None or self.pk is None or not row:
+            raise ValueError
+        if isinstance(row, dict) or isinstance(row, list) or isinstance(row, tuple):
+            condition, params = self._match_sql(row)
+            return self.curs.execute(f'SELECT COUNT(*) FROM "{self.table}" WHERE {condition}', params).fetchone()[0]
+        else:
+            raise TypeError
+
+    def __contains__(self, row):
+        """Return True if table has row given by dictionary, list or tuple.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        if not row or not (isinstance(row, dict) or isinstance(row, list) or isinstance(row, tuple)):
+            return False
+        condition, params = self._match_sql(row)
+        return self.curs.execute(f'SELECT 1 FROM "{self.table}" WHERE {condition} LIMIT 1', params).fetchone() is not None
+
     def create_table(self, table_name, columns):
         """Create table with specified name and columns.
             columns format: [[column_name, datatype, not_null, unique, primary_key, default], ...]
@@ -421,14 +1094,331 @@ class SqlWrapper(object):
             elif not isinstance(default, int) and not isinstance(default, float):
                 raise ValueError
         self.curs.execute(f'CREATE TABLE {table_name} (' + ", ".join([f'"{c[0]}" {c[1]}{" NOT NULL" * c[2]}{" UNIQUE" * c[3]}{" PRIMARY KEY" * c[4]} DEFAULT {c[5]}' for c in columns]) + ')')
+        self.schema_clear(table_name)
+
+    def _fts_table(self):
+        """Return name of the full-text index of the table or None if it doesn't exist."""
+
+        name = self.table + '_fts'
+        if self.schema(name) is not None:
+            return name
+        return None
+
+    def create_fts(self, columns, tokenize='unicode61'):
+        """Create FTS5 full-text index over the specified text columns of the table and fill it.
+            The index is stored in '<table>_fts' table and kept in sync with the table by triggers.
+
+            Raises ValueError if self.table or self.pk is None,
+            if columns iterable is empty,
+            if any of columns is compressed."""
+
+        if self.table is None or self.pk is None or not columns or self._compressed.intersection(columns):
+            raise ValueError
+        fts = self.table + '_fts'
+        names = ", ".join(['"' + c + '"' for c in columns])
+        new = ", ".join(['new."' + c + '"' for c in columns])
+        old = ", ".join(['old."' + c + '"' for c in columns])
+        self.curs.execute(
+            f'CREATE VIRTUAL TABLE "{fts}" USING fts5({names}, content="{self.table}", content_rowid="{self.pk}", tokenize="{tokenize}")')
+        self.curs.execute(f'INSERT INTO "{fts}" ("{fts}") VALUES (\'rebuild\')')
+        self.curs.execute(
+            f'CREATE TRIGGER "{fts}_insert" AFTER INSERT ON "{self.table}" BEGIN '
+            f'INSERT INTO "{fts}" (rowid, {names}) VALUES (new."{self.pk}", {new}); END')
+        self.curs.execute(
+            f'CREATE TRIGGER "{fts}_delete" AFTER DELETE ON "{self.table}" BEGIN '
+            f'INSERT INTO "{fts}" ("{fts}", rowid, {names}) VALUES (\'delete\', old."{self.pk}", {old}); END')
+        self.curs.execute(
+            f'CREATE TRIGGER "{fts}_update" AFTER UPDATE OF "{self.pk}", {names} ON "{self.table}" BEGIN '
+            f'INSERT INTO "{fts}" ("{fts}", rowid, {names}) VALUES (\'delete\', old."{self.pk}", {old}); '
+            f'INSERT INTO "{fts}" (rowid, {names}) VALUES (new."{self.pk}", {new}); END')
+        self.schema_clear(fts)
+
+    def drop_fts(self):
+        """Drop full-text index of the table and its triggers.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        fts = self.table + '_fts'
+        for event in ('insert', 'delete', 'update'):
+            self.curs.execute(f'DROP TRIGGER IF EXISTS "{fts}_{event}"')
+        self.curs.execute(f'DROP TABLE IF EXISTS "{fts}"')
+        self.schema_clear(fts)
+
+    def search(self, query, limit=None, rows=False, **filters):
+        """Return positions of the rows matching FTS5 query ordered by relevance, or row tuples if rows is True.
+
+            Query syntax is FTS5's: words, "phrases", prefixes (щук*), AND/OR/NOT, column filters (text: клев).
+            filters restrict matches by other columns: column=value for equality or column=(low, high) for inclusive range,
+            None as low or high leaves that end open, e.g. search('щук*', date=(start, None), is_report=True).
+
+            Raises ValueError if self.table or self.pk is None,
+            if the table has no full-text index."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        fts = self._fts_table()
+        if fts is None:
+            raise ValueError
+        conditions = [f'"{fts}" MATCH ?']
+        params = [query]
+        for column, value in filters.items():
+            if isinstance(value, tuple):
+                if value[0] is not None:
+                    conditions.append(f'{self._column_expr(column, "t.")} >= ?')
+                    params.append(value[0])
+                if value[1] is not None:
+                    conditions.append(f'{self._column_expr(column, "t.")} <= ?')
+                    params.append(value[1])
+            else:
+                conditions.append(f'{self._column_expr(column, "t.")} IS ?')
+                params.append(value)
+        selected = self._select_sql('t.') if rows else f't."{self.pk}"'
+        sql = (f'SELECT {selected} FROM "{fts}" JOIN "{self.table}" AS t ON t."{self.pk}" = "{fts}".rowid '
+               f'WHERE {" AND ".join(conditions)} ORDER BY "{fts}".rank')
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        result = self.curs.execute(sql, params).fetchall()
+        if rows:
+            return result
+        return [self._row_position(i) for (i,) in result]
+
+    def where(self, **columns):
+        """Return lazy Query over the table keeping rows whose columns are equal to the values, see query.Query.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        return Query(self).where(**columns)
+
+    def create_index(self, columns, unique=False, name=None):
+        """Create index on the specified columns of the table, composite if there are several ones.
+            Index name is '<table>_<column>_..._idx' unless name is specified.
+
+            Raises ValueError if self.table or self.pk is None,
+            if columns iterable is empty."""
+
+        if self.table is None or self.pk is None or not columns:
+            raise ValueError
+        if name is None:
+            name = '_'.join([self.table] + list(columns) + ['idx'])
+        names = ", ".join(['"' + c + '"' for c in columns])
+        self.curs.execute(f'CREATE {"UNIQUE " * unique}INDEX IF NOT EXISTS "{name}" ON "{self.table}" ({names})')
+        self._query_counts.clear()
+        self.schema_clear(self.table)
+
+    def drop_index(self, columns=None, name=None):
+        """Drop index by name or by columns it was created on with default name.
+
+            Raises ValueError if self.table or self.pk is None,
+            if neither columns nor name is specified."""
+
+        if self.table is None or self.pk is None or (not columns and name is None):
+            raise ValueError
+        if name is None:
+            name = '_'.join([self.table] + list(columns) + ['idx'])
+        self.curs.execute(f'DROP INDEX IF EXISTS "{name}"')
+        self.schema_clear(self.table)
+
+    def indexes(self):
+        """Return dictionary mapping names of the table's indexes to lists of their columns.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        return {name: list(index.columns) for name, index in self.schema(self.table).indexes.items()}
+
+    def create_hash_index(self):
+        """Add HASH_COLUMN holding content_hash() of every row and index it, so index(), remove(), count() and 'in'
+            find rows given with all columns by one index lookup. The column is hidden from rows and maintained
+            by append(), extend() and __setitem__(), rows written by other means must set it to content_hash() of their
+            values (see json2db.py). Defaults of columns missing in appended rows must be constants.
+
+            Raises ValueError if self.table or self.pk is None,
+            if the table already has HASH_COLUMN."""
+
+        if self.table is None or self.pk is None or self._hashed:
+            raise ValueError
+        self.curs.execute(f'ALTER TABLE "{self.table}" ADD "{HASH_COLUMN}" INTEGER')
+        self.schema_clear(self.table)
+        self._update_hashes()
+        self.curs.execute(f'CREATE INDEX "{self.table}_{HASH_COLUMN}_idx" ON "{self.table}" ("{HASH_COLUMN}")')
+        self.schema_clear(self.table)
+
+    def _update_hashes(self, batch_size=10000):
+        """Recompute HASH_COLUMN of all rows."""
+
+        columns = ", ".join([self._column_expr(c) for c in self.column_names])
+        pk = self.column_names.index(self.pk)
+        where = ''
+        params = []
+        while True:
+            rows = self.curs.execute(f'SELECT {columns} FROM "{self.table}"{where} ORDER BY "{self.pk}" LIMIT {batch_size}', params).fetchall()
+            if not rows:
+                return
+            self.curs.executemany(f'UPDATE "{self.table}" SET "{HASH_COLUMN}" = ? WHERE "{self.pk}" = ?',
+                                  [(self._row_hash(row), row[pk]) for row in rows])
+            where = f' WHERE "{self.pk}" > ?'
+            params = [rows[-1][pk]]
+
+    def drop_hash_index(self):
+        """Drop HASH_COLUMN and its index.
+
+            Raises ValueError if self.table or self.pk is None,
+            if the table has no HASH_COLUMN."""
+
+        if self.table is None or self.pk is None or not self._hashed:
+            raise ValueError
+        self.curs.execute(f'DROP INDEX IF EXISTS "{self.table}_{HASH_COLUMN}_idx"')
+        self.curs.execute(f'ALTER TABLE "{self.table}" DROP COLUMN "{HASH_COLUMN}"')
+        self.schema_clear(self.table)
+
+    def track_version(self):
+        """Start counting changes of the table made by any connection.
+            The counter is stored in VERSIONS_TABLE and incremented by triggers on every inserted, updated or deleted row.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        name = self.table.replace("'", "''")
+        self.curs.execute(f'CREATE TABLE IF NOT EXISTS "{VERSIONS_TABLE}" (name TEXT NOT NULL PRIMARY KEY, version INTEGER NOT NULL)')
+        self.curs.execute(f'INSERT OR IGNORE INTO "{VERSIONS_TABLE}" (name, version) VALUES (?, 0)', (self.table,))
+        self.schema_clear(VERSIONS_TABLE)
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            self.curs.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "{self.table}_version_{event.lower()}" AFTER {event} ON "{self.table}" '
+                f'BEGIN UPDATE "{VERSIONS_TABLE}" SET version = version + 1 WHERE name = \'{name}\'; END')
+
+    def table_version(self):
+        """Return change counter of the table or None if track_version() wasn't called for it.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        try:
+            version = self.curs.execute(f'SELECT version FROM "{VERSIONS_TABLE}" WHERE name = ?', (self.table,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return version[0] if version else None
+
+    def table_stamp(self):
+        """Return JSON-serializable list changing with the table: ['version', table_version()] if the version is tracked,
+            else ['files', ...] with sizes and modification times of the database file and its WAL file,
+            so any change of the database changes it.
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        version = self.table_version()
+        if version is not None:
+            return ['version', version]
+        stamp = ['files']
+        for filename in (self.filename, self.filename + '-wal'):
+            if os.path.exists(filename):
+                stat = os.stat(filename)
+                stamp += [stat.st_size, stat.st_mtime_ns]
+        return stamp
+
+    def to_numpy(self, columns):
+        """Return dictionary of NumPy arrays with values of the specified columns, see columnar.read_columns()."""
+
+        import columnar
+        return columnar.read_columns(self, columns)
+
+    def load_columns(self, columns, directory=None):
+        """Return dictionary of memory-mapped NumPy arrays with values of the specified columns, see columnar.load_columns()."""
+
+        import columnar
+        return columnar.load_columns(self, columns, directory)
+
+    def map_rows(self, func, columns=None, processes=None, chunks=None):
+        """Yield func(row) for every row of the table in order, computed by a pool of processes, see parallel.map_rows().
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        import parallel
+        yield from parallel.map_rows(self, func, columns, processes, chunks)
+
+    def aggregate(self, func, combine=None, columns=None, processes=None, chunks=None):
+        """Return results of func(rows) over primary key ranges of the table computed by a pool of processes
+            and combined in order by combine(a, b), see parallel.aggregate().
+
+            Raises ValueError if self.table or self.pk is None."""
+
+        import parallel
+        return parallel.aggregate(self, func, combine, columns, processes, chunks)
+
+    def compress_column(self, column, dictionary=None, level=9):
+        """Store text values of the column compressed by zlib, see compression module.
+            Values are decompressed only by queries reading the column, so reading other columns doesn't pay for it,
+            and values written through SqlWrapper are compressed. Other tools see compressed values as BLOBs.
+
+            dictionary is zlib preset dictionary improving compression of short values: bytes
+            or True to train it on a sample of the column. It's stored with level in COMPRESSION_TABLE.
+            Space freed by compression is reused by SQLite, run VACUUM after commit to shrink the file.
+
+            Raises ValueError if self.table or self.pk is None,
+            if the table has no such column or it is the primary key,
+            if the column is already compressed,
+            if the column is in full-text index, which can't read compressed values."""
+
+        if self.table is None or self.pk is None:
+            raise ValueError
+        if column not in self.column_names or column == self.pk or column in self._compressed:
+            raise ValueError
+        fts = self._fts_table()
+        if fts is not None and column in [c[0] for c in self.schema(fts).columns]:
+            raise ValueError
+        if dictionary is True:
+            step = max(self.__len__() // 2000, 1)
+            samples = self.curs.execute(
+                f'SELECT "{column}" FROM "{self.table}" WHERE "{self.pk}" % {step} = 0 LIMIT 2000').fetchall()
+            dictionary = compression.train_dictionary(v for (v,) in samples if isinstance(v, str))
+        self.curs.execute(f'CREATE TABLE IF NOT EXISTS "{COMPRESSION_TABLE}" (table_name TEXT NOT NULL, column_name TEXT NOT NULL, '
+                          f'dictionary BLOB, level INTEGER NOT NULL, PRIMARY KEY (table_name, column_name))')
+        self.curs.execute(f'INSERT INTO "{COMPRESSION_TABLE}" VALUES (?, ?, ?, ?)', (self.table, column, dictionary, level))
+        self.schema_clear(COMPRESSION_TABLE)
+        self._load_compression()
+        self.curs.execute(f'UPDATE "{self.table}" SET "{column}" = sqlwrapper_compress("{column}", {_literal(self.table)}, {_literal(column)})')
+        self._cache.clear()
+
+    def decompress_column(self, column):
+        """Store values of the column compressed by compress_column() as text again.
+
+            Raises ValueError if self.table or self.pk is None,
+            if the column is not compressed."""
+
+        if self.table is None or self.pk is None or column not in self._compressed:
+            raise ValueError
+        self.curs.execute(f'UPDATE "{self.table}" SET "{column}" = {self._column_expr(column)}')
+        self.curs.execute(f'DELETE FROM "{COMPRESSION_TABLE}" WHERE table_name = ? AND column_name = ?', (self.table, column))
+        self._load_compression()
+        self._cache.clear()
 
     def drop_table(self, table_name):
         """Drop specified table."""
 
         self.curs.execute(f'DROP TABLE "{table_name}"')
+        try:
+            self.curs.execute(f'DELETE FROM "{VERSIONS_TABLE}" WHERE name = ?', (table_name,))
+        except sqlite3.OperationalError:
+            pass
+        try:
+            self.curs.execute(f'DELETE FROM "{COMPRESSION_TABLE}" WHERE table_name = ?', (table_name,))
+        except sqlite3.OperationalError:
+            pass
+        self._load_compression()
+        self.schema_clear(table_name)
+        if table_name == self.table:
+            self._cache.clear()
 
     def add_column(self, column_name, datatype, not_null=False, default=None):
         """Add column with specified name, datatype and constraints 'NOT NULL' and 'DEFAULT'.
+            Content hashes are recomputed if the table has HASH_COLUMN.
 
             Raises ValueError if datatype is not 'NULL', 'INTEGER', 'REAL', 'TEXT', 'BLOB' or 'NUMERIC',
             if default isn't string True, False, None or number,
@@ -451,3 +1441,7 @@ class SqlWrapper(object):
         elif not isinstance(default, int) and not isinstance(default, float):
             raise ValueError
         self.curs.execute(f'ALTER TABLE "{self.table}" ADD "{column_name}" {datatype}{" NOT NULL" * not_null} DEFAULT {default}')
+        self._cache.clear()
+        self.schema_clear(self.table)
+        if self._hashed:
+            self._update_hashes()
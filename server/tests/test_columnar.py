@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from columnar import TextColumn  # noqa: E402
+from sql_wrapper import SqlWrapper  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SqlWrapper(str(tmp_path / 'test.db'), True)
+    db.curs.execute('CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, a, n INTEGER, r REAL, flag BOOLEAN, s TEXT)')
+    db.set_table('t', 'id')
+    yield db
+    db.close()
+
+
+def test_columns_of_empty_table_follow_declared_types(db):
+    columns = db.to_numpy(['a', 's', 'n', 'r', 'flag'])
+    assert len(columns['a']) == 0 and len(columns['s']) == 0
+    assert columns['s'].lengths().tolist() == []
+    assert columns['n'].dtype == np.int64
+    assert columns['r'].dtype == np.float64
+    assert columns['flag'].dtype == np.bool_
+
+
+def test_mixed_text_and_numbers_are_read_as_text(db):
+    db.extend([(None, 'лещ', 1, 1.5, True, 'a'), (None, 5, None, 2, False, 'b'), (None, 2.5, 3, None, True, 'c'),
+               (None, None, 4, 1, False, 'd')])
+    db.commit()
+    columns = db.to_numpy(['a', 'n', 'r', 'flag'])
+    assert [columns['a'][i] for i in range(4)] == ['лещ', '5', '2.5', '']
+    assert columns['n'].dtype == np.float64 and np.isnan(columns['n'][1])
+    assert columns['r'].tolist()[:2] == [1.5, 2.0] and np.isnan(columns['r'][2])
+    assert columns['flag'].tolist() == [True, False, True, False]
+
+
+def test_cached_columns_of_empty_table(db, tmp_path):
+    columns = db.load_columns(['s', 'n'], str(tmp_path / 'columns'))
+    assert isinstance(columns['s'], TextColumn) and len(columns['s']) == 0
+    assert columns['n'].dtype == np.int64
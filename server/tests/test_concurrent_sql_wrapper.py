@@ -0,0 +1,147 @@
+import random
+import threading
+
+from concurrent_sql_wrapper import ConcurrentSqlWrapper
+from sql_wrapper import SqlWrapper
+
+
+def make_db(tmp_path, rows=100, **kwargs):
+    db = ConcurrentSqlWrapper(str(tmp_path / 'reports.db'), **kwargs)
+    db.create_table('t', [['id', 'INTEGER', True, True, True], ['a', 'INTEGER'], ['b', 'TEXT']])
+    db.set_table('t', 'id')
+    db.extend([(None, i, f'row {i}') for i in range(rows)])
+    return db
+
+
+def test_readers_and_writer(tmp_path):
+    db = make_db(tmp_path)
+    appends = 300
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        try:
+            for i in range(100, 100 + appends):
+                db.append((None, i, f'row {i}'))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        last = 0
+        try:
+            while not done.is_set():
+                length = len(db)
+                assert last <= length <= 100 + appends
+                last = length
+                pos = rng.randrange(length)
+                assert db[pos] == (pos + 1, pos, f'row {pos}')
+                assert db[-1][1] >= length - 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(8)] + [threading.Thread(target=writer)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(db) == 100 + appends
+    assert [row[1] for row in db[:]] == list(range(100 + appends))
+    other = SqlWrapper(str(tmp_path / 'reports.db'), True)
+    other.set_table('t', 'id')
+    assert len(other) == 100 + appends
+    other.close()
+    db.close()
+
+
+def test_concurrent_writes_are_not_lost(tmp_path):
+    db = make_db(tmp_path, rows=1)
+    db[0] = (None, 0, 'counter')
+
+    def increment():
+        for _ in range(200):
+            with db._write_lock:
+                db[0] = (None, db[0][1] + 1, 'counter')
+
+    threads = [threading.Thread(target=increment) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert db[0][1] == 1000
+    db.close()
+
+
+def test_short_lived_threads_reuse_connections(tmp_path):
+    db = make_db(tmp_path, pool_size=4)
+
+    def read():
+        assert db[5] == (6, 5, 'row 5')
+
+    for _ in range(200):
+        t = threading.Thread(target=read)
+        t.start()
+        t.join()
+    assert len(db._open_connections()) <= 1 + 4
+
+    barrier = threading.Barrier(20)
+
+    def read_together():
+        read()
+        barrier.wait()
+
+    threads = [threading.Thread(target=read_together) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(db._open_connections()) <= 1 + 4
+    db.close()
+    assert db._open_connections() == []
+
+
+def test_ddl_runs_through_writer(tmp_path):
+    db = make_db(tmp_path)
+    db.create_index(['a'])
+    db.create_fts(['b'])
+    assert not db.conn.in_transaction
+    db.append((None, 100, 'row 100'))
+    db.drop_fts()
+    db.drop_index(['a'])
+    db.compress_column('b')
+    assert not db.conn.in_transaction
+    db.append((None, 101, 'row 101'))
+    assert db[101] == (102, 101, 'row 101')
+    db.decompress_column('b')
+    db.append((None, 102, 'row 102'))
+    assert len(db) == 103
+    db.create_index(['a'])
+    with db.connection_profile('bulk_load'):
+        assert 't_a_idx' not in db.indexes()
+        db.extend([(None, i, f'row {i}') for i in range(103, 200)])
+        assert read_in_thread(db, 5) == (6, 5, 'row 5')
+    assert db.indexes()['t_a_idx'] == ['a']
+    db.append((None, 200, 'row 200'))
+    assert read_in_thread(db, 200) == (201, 200, 'row 200')
+    db.set_connection_profile('bulk_load')
+    db.extend([(None, i, f'row {i}') for i in range(201, 300)])
+    db.set_connection_profile('safe')
+    assert db.indexes()['t_a_idx'] == ['a']
+    assert len(db) == 300
+    db.set_connection_profile('bulk_load')
+    db.close()
+    db = ConcurrentSqlWrapper(str(tmp_path / 'reports.db'))
+    db.set_table('t', 'id')
+    assert db.indexes()['t_a_idx'] == ['a']
+    db.close()
+
+
+def read_in_thread(db, pos):
+    rows = []
+    thread = threading.Thread(target=lambda: rows.append(db[pos]))
+    thread.start()
+    thread.join()
+    return rows[0] if rows else None
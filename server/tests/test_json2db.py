@@ -0,0 +1,107 @@
+import random
+import sqlite3
+
+import pytest
+
+import json2db
+from sql_wrapper import SqlWrapper
+
+
+ROWS = [(1600000000, 1, 'Волга', 'Тверь', 'поймал щуку', 2, 'f1'),
+        (1600086400, 0, 'Ока', 'Калуга', 'клева нет', 0, 'f2')]
+
+
+def test_reports_accept_rows_without_fingerprint(tmp_path):
+    filename = str(tmp_path / 'reports.db')
+    json2db.write_rows(ROWS, filename)
+    db = SqlWrapper(filename, True)
+    db.set_table('reports', 'id')
+    db.append((None, 1600172800, 1, 'Дон', 'Ростов', 'лещ', 1))
+    db.append({'date': 1600172800, 'is_report': 0, 'main_place': 'Дон', 'place': 'Ростов', 'text': 'сом', 'emoticons': 0})
+    db.extend([(None, 1600172800, 1, 'Дон', 'Ростов', 'судак', 0)])
+    db.commit()
+    assert len(db) == 5
+    assert db[2] == (3, 1600172800, 1, 'Дон', 'Ростов', 'лещ', 1)
+    db.close()
+    conn = sqlite3.connect(filename)
+    assert conn.execute(f'SELECT {json2db.FINGERPRINT_COLUMN} FROM reports ORDER BY id').fetchall() == [('f1',), ('f2',), (None,), (None,), (None,)]
+    conn.close()
+
+
+
+def entries(start, stop):
+    return [(1600000000000 + i * 3600000, i % 2, f'река {i % 7}', f'место {i % 5}', f'сообщение номер {i} <b>текст</b>')
+            for i in range(start, stop)]
+
+
+@pytest.mark.parametrize('compressed', [('text',), ('text', 'main_place')])
+def test_merge_into_compressed_database(tmp_path, compressed):
+    filename = str(tmp_path / 'reports.db')
+    json2db.write_rows(json2db.clean_rows(entries(0, 300)), filename, fts_columns=(), compressed_columns=compressed)
+    changed = [(e[0], 1 - e[1], 'другая река', e[3], e[4]) for e in entries(0, 10)]
+    assert json2db.merge_rows(changed + entries(10, 450), filename) == (150, 10)
+    conn = sqlite3.connect(filename)
+    for column in compressed:
+        assert conn.execute(f'SELECT DISTINCT typeof({column}) FROM reports').fetchall() == [('blob',)]
+    conn.close()
+    db = SqlWrapper(filename, True)
+    db.set_table('reports', 'id')
+    assert len(db) == 450
+    assert db[0][3] == 'другая река'
+    assert db[449][5] == 'сообщение номер 449 текст'
+    db.close()
+    assert json2db.merge_rows(entries(0, 450), filename) == (0, 10)
+
+
+def test_merge_cleans_only_new_entries(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'reports.db')
+    json2db.write_rows(json2db.clean_rows(entries(0, 100)), filename)
+    empty = [(1600000000000, 0, 'река', 'место', '<b></b>'), (1600000000000, 0, 'река', 'другое место', '<i> </i>'),
+             (1600000000000, 0, 'река', 'место', '<b></b>')]
+    # repeated entries are more than a chunk of lookups apart
+    assert json2db.merge_rows(entries(100, 700) + empty + entries(100, 700), filename) == (600, 0)
+    conn = sqlite3.connect(filename)
+    assert conn.execute(f'SELECT COUNT(*) FROM {json2db.FILTERED_TABLE}').fetchone()[0] == 2
+    conn.close()
+    cleaned = []
+    monkeypatch.setattr(json2db, 'clean_entry', lambda entry: cleaned.append(entry))
+    assert json2db.merge_rows(entries(0, 700) + empty, filename) == (0, 0)
+    assert cleaned == []
+
+def old_clean_text(text):
+    """Cleaning loop clean_text() replaced: remove the first match from the beginning of the message until none is left."""
+
+    emoticons = 0
+    while True:
+        match = json2db._MARKUP.search(text)
+        if match is None:
+            break
+        text = text.replace(match.group(0), '', 1)
+        if match.group(5):
+            emoticons += 1
+    return json2db._SPACES.sub(' ', text), emoticons
+
+
+@pytest.mark.parametrize('text, cleaned', [
+    ('<a x="p q r" <b>>', ''),
+    (') щ<3   x="p q":P  >;)', ') щ'),
+    ('клев <b>отличный</b> :)  был', 'клев отличный был'),
+    ('ab<a <?]|x:)<a :PB: _>щ>  : ab :', 'ab<a'),
+    ('>":Px" >:b:>"("3<].* y="<:P<i<a x="<b> >":d:"<3 P/b :', '>":Px" >>"("3""<3 P/b :'),
+])
+def test_clean_text(text, cleaned):
+    assert json2db.clean_text(text)[0] == cleaned
+    assert json2db.clean_text(text) == old_clean_text(text)
+
+
+@pytest.mark.parametrize('count, length, pending_size', [(20000, 30, json2db.PENDING_SIZE), (200, 1000, json2db.PENDING_SIZE),
+                                                          (20000, 30, 0)])
+def test_clean_text_matches_old_loop(monkeypatch, count, length, pending_size):
+    monkeypatch.setattr(json2db, 'PENDING_SIZE', pending_size)
+    pieces = ['<', '>', '"', '=', '/', ' ', '   ', ':', ';', ')', '(', '3', 'P', 'D', '-', 'a', 'щ', '<b>', '</b>',
+              '<a x="p q">', ' x="', 'p q', '" ', ':)', ':P', '<3', ': ab :', 'x="<" ', '">"', '!', '8', '^', '\\',
+              '<i', ' y="<', 'B-)']
+    rnd = random.Random(0)
+    for _ in range(count):
+        text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, length)))
+        assert json2db.clean_text(text) == old_clean_text(text), text
@@ -0,0 +1,56 @@
+import warnings
+
+import pytest
+
+from query import ScanWarning
+from sql_wrapper import SqlWrapper
+
+
+ROWS = [(None, i % 4, None if i % 5 == 0 else f'b{i % 3}') for i in range(40)]
+
+
+@pytest.fixture(params=[{'store_len': True}, {'store_len': True, 'sparse_ids': True}], ids=['dense_ids', 'sparse_ids'])
+def db(request, tmp_path):
+    db = SqlWrapper(str(tmp_path / 'test.db'), **request.param)
+    db.create_table('t', [['id', 'INTEGER', True, True, True], ['a', 'INTEGER'], ['b', 'TEXT']])
+    db.set_table('t', 'id')
+    db.extend(ROWS)
+    db.commit()
+    del db[:5]
+    db.commit()
+    yield db
+    db.close()
+
+
+def test_where_builder(db):
+    rows = db[:]
+    assert list(db.where()) == rows
+    assert list(db.where(a=1)) == [r for r in rows if r[1] == 1]
+    assert list(db.where(a=2, b=None)) == [r for r in rows if r[1] == 2 and r[2] is None]
+    assert list(db.where().where_in('b', ['b0', 'b2']).range('a', 1, 2)) == [r for r in rows if r[2] in ('b0', 'b2') and 1 <= r[1] <= 2]
+    assert list(db.where().range('a', high=0)) == [r for r in rows if r[1] <= 0]
+    ordered = sorted(rows, key=lambda r: (-r[1], r[0]))
+    assert list(db.where().order_by('a', desc=True).limit(7, 3)) == ordered[3:10]
+    assert list(db.where(b='b1').select('a')) == [(r[1],) for r in rows if r[2] == 'b1']
+    assert list(db.where(a=3).positions()) == [i for i, r in enumerate(rows) if r[1] == 3]
+    assert db.where(a=3).order_by('id', desc=True).first() == [r for r in rows if r[1] == 3][-1]
+    assert db.where(a=5).first() is None
+    assert db.where(a=1).count() == len([r for r in rows if r[1] == 1])
+    assert db.where(a=1).limit(2).count() == 2
+
+
+def test_scan_warning_only_for_frequent_filtered_scans(db):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', ScanWarning)
+        for _ in range(2 * db.scan_warning_threshold):
+            list(db.where())
+            list(db.where().order_by('a'))
+    for _ in range(db.scan_warning_threshold - 1):
+        list(db.where(a=1))
+    with pytest.warns(ScanWarning):
+        list(db.where(a=1))
+    db.create_index(['a'])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', ScanWarning)
+        for _ in range(2 * db.scan_warning_threshold):
+            list(db.where(a=1))
@@ -0,0 +1,170 @@
+import itertools
+import random
+import sqlite3
+
+import pytest
+
+from sql_wrapper import SqlWrapper, content_hash
+
+
+@pytest.fixture(params=[{'store_len': True}, {'store_len': False}, {'store_len': True, 'sparse_ids': True}],
+                ids=['store_len', 'count', 'sparse_ids'])
+def db(request, tmp_path):
+    db = SqlWrapper(str(tmp_path / 'test.db'), **request.param)
+    db.create_table('t', [['id', 'INTEGER', True, True, True], ['a', 'INTEGER'], ['b', 'TEXT']])
+    db.set_table('t', 'id')
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('idx', [slice(None), slice(-1, -1), slice(-5, None), slice(None, -3, 2), slice(None, None, -1)])
+def test_slices_of_empty_table(db, idx):
+    assert db[idx] is None
+    assert list(db.iter_rows(idx)) == []
+
+
+def test_close_rebuilds_indexes_dropped_by_bulk_load(tmp_path):
+    filename = str(tmp_path / 'test.db')
+    db = SqlWrapper(filename, True)
+    db.create_table('t', [['id', 'INTEGER', True, True, True], ['a', 'INTEGER'], ['b', 'TEXT']])
+    db.set_table('t', 'id')
+    db.create_index(['a'])
+    db.set_connection_profile('bulk_load')
+    assert 't_a_idx' not in db.indexes()
+    db.extend([(None, i, str(i)) for i in range(100)])
+    db.close()
+    db = SqlWrapper(filename, True)
+    db.set_table('t', 'id')
+    assert db.indexes()['t_a_idx'] == ['a']
+    assert len(db) == 100
+    db.close()
+
+
+def test_table_stamp_changes_with_table(db):
+    stamp = db.table_stamp()
+    assert stamp[0] == 'files'
+    db.append((None, 1, 'x'))
+    db.commit()
+    assert db.table_stamp() != stamp
+    db.track_version()
+    db.commit()
+    stamp = db.table_stamp()
+    assert stamp[0] == 'version'
+    assert db.table_stamp() == stamp
+    db.append((None, 2, 'y'))
+    db.commit()
+    assert db.table_stamp() != stamp
+
+
+def random_slice(rnd):
+    bound = lambda: rnd.choice([None, rnd.randint(-25, 25)])
+    return slice(bound(), bound(), rnd.choice([None, 1, 2, 3, -1, -2, -3]))
+
+
+def check_rows(db, model, rnd):
+    assert len(db) == len(model)
+    assert [row[1:] for row in db.iter_rows()] == model
+    for _ in range(5):
+        idx = random_slice(rnd)
+        assert [row[1:] for row in db[idx] or []] == model[idx], idx
+        assert [row[1:] for row in db.iter_rows(idx)] == model[idx], idx
+    if model:
+        pos = rnd.randrange(-len(model), len(model))
+        assert db[pos][1:] == model[pos]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_list_operations_match_list(db, seed):
+    rnd = random.Random(seed)
+    model = []
+    counter = 0
+    for _ in range(300):
+        op = rnd.choice(['append', 'extend', 'del', 'del_slice', 'pop', 'remove'])
+        if op == 'append' or not model:
+            counter += 1
+            db.append((None, counter, str(counter)))
+            model.append((counter, str(counter)))
+        elif op == 'extend':
+            rows = [(counter + i, str(counter + i)) for i in range(1, rnd.randint(1, 8))]
+            counter += len(rows)
+            db.extend([(None,) + row for row in rows])
+            model.extend(rows)
+        elif op == 'del':
+            pos = rnd.randrange(-len(model), len(model))
+            del db[pos]
+            del model[pos]
+        elif op == 'del_slice':
+            idx = random_slice(rnd)
+            del db[idx]
+            del model[idx]
+        elif op == 'pop':
+            pos = rnd.randrange(-len(model), len(model))
+            assert db.pop(pos)[1:] == model.pop(pos)
+        else:
+            row = rnd.choice(model)
+            db.remove((None,) + row)
+            model.remove(row)
+        check_rows(db, model, rnd)
+
+
+VALUES = ['5', 5, 5.0, True, False, '2.5', 2.5, ' 5 ', '05', '5e2', 'abc', None, b'5', '1', 1, 0.0, 1e20, '1e20',
+          '9223372036854775808', '.5', '', 0.1, '0.1']
+
+
+@pytest.mark.parametrize('datatype', ['INTEGER', 'REAL', 'TEXT', 'BLOB', 'NUMERIC', '', 'VARCHAR(10)', 'BOOLEAN'])
+def test_content_hash_follows_sqlite_affinity(datatype):
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f'CREATE TABLE v (i INTEGER PRIMARY KEY, x {datatype})')
+    conn.executemany('INSERT INTO v VALUES (?, ?)', enumerate(VALUES))
+    stored = [x for (x,) in conn.execute('SELECT x FROM v ORDER BY i')]
+    for value, stored_value in zip(VALUES, stored):
+        assert content_hash([value], [datatype]) == content_hash([stored_value], [datatype]), value
+    for (i, a), (j, b) in itertools.product(enumerate(VALUES), repeat=2):
+        equal = conn.execute('SELECT (SELECT x FROM v WHERE i = ?) IS (SELECT x FROM v WHERE i = ?)', (i, j)).fetchone()[0]
+        assert bool(equal) == (content_hash([a], [datatype]) == content_hash([b], [datatype])), (a, b)
+    conn.close()
+
+
+def check_lookups(db, written, pos, count):
+    for row in written:
+        assert db.index((None,) + row) == pos, row
+        assert db.count((None,) + row) == count, row
+        assert (None,) + row in db, row
+
+
+def test_hash_lookups_find_converted_values(db):
+    db.extend([(None, '5', 2.5), (None, 7, 'x')])
+    db.create_hash_index()
+    check_lookups(db, [(5, '2.5'), ('5', 2.5), (5.0, '2.5')], 0, 1)
+    db.append((None, True, 5.0))
+    db.append((None, 5.0, '2.5'))
+    check_lookups(db, [(1, '5.0'), (True, 5.0), ('1', '5.0')], 2, 1)
+    check_lookups(db, [(5, '2.5'), ('5', 2.5), (5.0, '2.5')], 0, 2)
+    db[1] = (None, '2.5', True)
+    check_lookups(db, [(2.5, '1'), ('2.5', True), ('2.5', 1)], 1, 1)
+    db.add_column('c', 'REAL', default=0)
+    check_lookups(db, [(5, '2.5', 0.0), ('5', 2.5, False), (5.0, '2.5', '0')], 0, 2)
+    db.remove((None, '5', 2.5, False))
+    check_lookups(db, [(5, '2.5', 0.0), ('5', 2.5, '0')], 2, 1)
+    assert (None, True, 5.0, '0') in db
+    db.commit()
+
+
+def test_fts_follows_renumbering(db):
+    words = ['щука', 'лещ', 'окунь', 'сом', 'судак', 'карп']
+    db.extend([(None, i, f'{w} {i}') for i, w in enumerate(words * 4)])
+    db.create_fts(['b'])
+    del db[2]
+    del db[:3]
+    db[4] = (None, 100, 'налим')
+    db.pop(0)
+    db.append((None, 200, 'щука новая'))
+    del db[3:12:2]
+    db.remove((None, 23, 'карп 23'))
+    db.commit()
+    db.curs.execute("INSERT INTO t_fts (t_fts) VALUES ('integrity-check')")
+    rows = db[:]
+    for word in words + ['налим', 'новая']:
+        expected = [i for i, row in enumerate(rows) if word in row[2].split()]
+        assert sorted(db.search(word)) == expected, word
+        assert sorted(db.search(word, rows=True)) == [rows[i] for i in expected], word